@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in motionEye HTTP server for the benchmarks.
+
+Run it alone with : python benchmarks/fake_motioneye.py --cameras 10 --port 8765
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+
+class FakeMotionEyeServer:
+    """
+    Answer the motionEye requests of the driver for a number of cameras, with
+    a fixed latency, padded camera configs and random server errors
+    """
+
+    def __init__(
+        self, cameras=1, latency=0.0, payload=0, failure_rate=0.0, seed=0, port=8765
+    ):
+        self.cameras = cameras
+        # seconds before each answer
+        self.latency = latency
+        # bytes added to each camera config
+        self.payload = payload
+        # ratio of the requests answered with an error 500
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.port = port
+        self.runner = None
+        self.configs = dict()
+        # request name -> number of requests
+        self.requests = dict()
+        # snapshots served
+        self.frame = 0
+        # (camera id, "movie" or "picture") -> {path: (timestamp, bytes)}
+        self.media = dict()
+        self.reset()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.port
+
+    def reset(self):
+        self.requests = dict()
+        self.configs = {i: self.camera_config(i) for i in range(1, self.cameras + 1)}
+
+    def camera_config(self, camera_id):
+        return {
+            "id": camera_id,
+            "name": "camera %d" % camera_id,
+            "enabled": True,
+            "video_streaming": True,
+            "streaming_port": 9080 + camera_id,
+            "still_images": True,
+            "motion_detection": True,
+            "text_overlay": True,
+            "left_text": "camera-name",
+            "right_text": "timestamp",
+            "recording_mode": "motion-triggered",
+            "movies": True,
+            "movie_file_name": "%Y-%m-%d/%H-%M-%S",
+            "image_file_name": "%Y-%m-%d/%H-%M-%S",
+            "padding": "x" * self.payload,
+        }
+
+    def request_count(self):
+        return sum(self.requests.values())
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        name = request.match_info.route.name or request.path
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise web.HTTPInternalServerError()
+        return await handler(request)
+
+    def app(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.add_routes(
+            [
+                web.post("/login", self.login, name="login"),
+                web.get("/manifest.json", self.manifest, name="manifest"),
+                web.get("/config/main/get", self.server_config, name="server_config"),
+                web.get("/config/list", self.camera_list, name="cameras"),
+                web.post("/config/{camera_id}/set", self.set_camera, name="set_camera"),
+                web.post("/action/{camera_id}/{action}", self.action, name="action"),
+                web.get(
+                    "/picture/{camera_id}/current/", self.snapshot, name="snapshot"
+                ),
+                web.get("/movie/{camera_id}/list", self.movie_list, name="movies"),
+                web.get(
+                    "/picture/{camera_id}/list", self.picture_list, name="pictures"
+                ),
+                web.get(
+                    "/movie/{camera_id}/playback/{path:.*}",
+                    self.playback,
+                    name="playback",
+                ),
+            ]
+        )
+        return app
+
+    async def login(self, request):
+        response = web.json_response({})
+        response.set_cookie("user", "benchmark")
+        return response
+
+    async def manifest(self, request):
+        return web.json_response({"version": "0.42.1", "hostname": "fake"})
+
+    async def server_config(self, request):
+        return web.json_response({"admin_username": "admin", "normal_username": "user"})
+
+    async def camera_list(self, request):
+        return web.json_response({"cameras": list(self.configs.values())})
+
+    async def set_camera(self, request):
+        camera_id = int(request.match_info["camera_id"])
+        if camera_id not in self.configs:
+            raise web.HTTPNotFound()
+        self.configs[camera_id].update(await request.json())
+        return web.json_response({})
+
+    async def action(self, request):
+        return web.json_response({})
+
+    async def snapshot(self, request):
+        # a JPEG header and a frame counter, different at each request
+        self.frame += 1
+        body = b"\xff\xd8\xff\xe0" + str(self.frame).encode() + b"\xff\xd9"
+        return web.Response(body=body, content_type="image/jpeg")
+
+    def add_media(self, camera_id, kind, path, timestamp, size):
+        self.media.setdefault((camera_id, kind), dict())[path] = (timestamp, size)
+
+    def media_list(self, request, kind):
+        camera_id = int(request.match_info["camera_id"])
+        prefix = "/" + request.query.get("prefix", "").strip("/")
+        media = self.media.get((camera_id, kind), dict())
+        return web.json_response(
+            {
+                "mediaList": [
+                    {
+                        "path": path,
+                        "timestamp": timestamp,
+                        "sizeStr": "%.1f kB" % (size / 1024.0),
+                    }
+                    for path, (timestamp, size) in media.items()
+                    if path.startswith(prefix)
+                ]
+            }
+        )
+
+    async def movie_list(self, request):
+        return self.media_list(request, "movie")
+
+    async def picture_list(self, request):
+        return self.media_list(request, "picture")
+
+    def media_content(self, path, size):
+        return (path.encode() * (size // max(len(path), 1) + 1))[:size]
+
+    async def playback(self, request):
+        camera_id = int(request.match_info["camera_id"])
+        path = "/" + request.match_info["path"]
+        media = self.media.get((camera_id, "movie"), dict())
+        if path not in media:
+            raise web.HTTPNotFound()
+        content = self.media_content(path, media[path][1])
+        start = 0
+        if request.http_range.start is not None:
+            start = request.http_range.start
+            if start >= len(content):
+                raise web.HTTPRequestRangeNotSatisfiable(
+                    headers={"Content-Range": "bytes */%d" % len(content)}
+                )
+            response = web.StreamResponse(
+                status=206,
+                headers={
+                    "Content-Range": "bytes %d-%d/%d"
+                    % (start, len(content) - 1, len(content))
+                },
+            )
+        else:
+            response = web.StreamResponse()
+        response.content_length = len(content) - start
+        response.content_type = "video/mp4"
+        await response.prepare(request)
+        # sent in chunks so that a download can be interrupted
+        for i in range(start, len(content), 65536):
+            await response.write(content[i : i + 65536])
+        return response
+
+    async def async_start(self):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+
+    async def async_stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+        self.runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cameras", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--payload", type=int, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = FakeMotionEyeServer(
+        args.cameras, args.latency, args.payload, args.failure_rate, port=args.port
+    )
+    web.run_app(server.app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
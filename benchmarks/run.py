@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Poll and write throughput of the motionEye driver against a local fake server.
+
+    python benchmarks/run.py --cameras 1,10,100,500 --cycles 20
+
+With --media, each camera also lists and archives its movies and pictures;
+with --snapshots, each cycle fetches a snapshot of each camera.
+
+Uses benchmarks.settings (a throwaway sqlite database) unless
+DJANGO_SETTINGS_MODULE is set.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import resource
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from pyscada.models import Device, DeviceWriteTask, Unit, Variable
+
+from benchmarks.fake_motioneye import FakeMotionEyeServer
+from pyscada.motioneye import PROTOCOL_ID
+from pyscada.motioneye.devices import GenericDevice
+from pyscada.motioneye.loop import get_event_loop
+from pyscada.motioneye.models import (
+    MotionEyeServer,
+    MotionEyeDevice,
+    MotionEyeVariable,
+    SERVICE_CODECS,
+)
+from pyscada.motioneye.server import get_server_poller
+from pyscada.motioneye.snapshots import SnapshotSource
+from pyscada.motioneye.worker import DAQProcess
+
+# services of the variables of each camera, the first one is written
+SERVICES = ["left_text", "enabled", "recording_mode", "movies"]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # peak RSS, in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not len(values):
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def create_cameras(url, count, archive_dir=""):
+    server, _ = MotionEyeServer.objects.get_or_create(url=url)
+    MotionEyeServer.objects.filter(pk=server.pk).update(archive_dir=archive_dir)
+    server.refresh_from_db()
+    unit = Unit.objects.first() or Unit.objects.create(unit="-")
+    device_ids = []
+    for camera_id in range(1, count + 1):
+        device = Device.objects.create(
+            short_name="bench-%d" % camera_id,
+            protocol_id=PROTOCOL_ID,
+            polling_interval=1,
+        )
+        MotionEyeDevice.objects.create(
+            motioneye_device=device,
+            motioneye_server=server,
+            camera_id=camera_id,
+            # listed at each cycle by start_background
+            media_index_interval=3600 if archive_dir else 0,
+            archive_movies=bool(archive_dir),
+        )
+        for service in SERVICES:
+            variable = Variable.objects.create(
+                name="bench-%d-%s" % (camera_id, service), device=device, unit=unit
+            )
+            MotionEyeVariable(motioneye_variable=variable, service=service).save()
+        device_ids.append(device.pk)
+    return server, device_ids
+
+
+def add_media(fake, count, per_camera):
+    """
+    add movies and pictures of an hour ago to the cameras of the fake server
+    """
+    timestamp = time() - 3600
+    folder = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+    for camera_id in range(1, count + 1):
+        for i in range(per_camera):
+            path = "/%s/00-00-%02d" % (folder, i)
+            fake.add_media(camera_id, "movie", path + ".mp4", timestamp, 64 * 1024)
+            fake.add_media(camera_id, "picture", path + ".jpg", timestamp, 16 * 1024)
+
+
+def delete_cameras(server):
+    Device.objects.filter(motioneyedevice__motioneye_server=server).delete()
+
+
+async def async_wait_writes():
+    # config writes are sent by background tasks of the handlers
+    tasks = [
+        t
+        for t in asyncio.all_tasks()
+        if t is not asyncio.current_task()
+        and t.get_coro().__name__ == "async_flush_config"
+    ]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def write_values(variable, cycle):
+    codec = SERVICE_CODECS[variable.motioneyevariable.service]
+    values = sorted(codec["forward"])
+    return values[cycle % len(values)]
+
+
+def start_background(handlers, args, archiver=None):
+    """
+    list the media of the cameras and look for movies to archive on this cycle
+    """
+    if not args.media:
+        return
+    for handler in handlers:
+        handler._next_media_index = 0
+    if archiver is not None:
+        archiver.next_check = 0
+
+
+async def async_get_snapshots(handlers):
+    await asyncio.gather(
+        *[h.snapshots.async_get() for h in handlers if h.snapshots is not None],
+        return_exceptions=True,
+    )
+
+
+def wait_background(event_loop, handlers, args, archiver=None):
+    """
+    fetch the snapshots of the cycle, wait for the media listings and the
+    downloads and store them
+    """
+    if args.snapshots:
+        event_loop.run(async_get_snapshots(handlers))
+    futures = [h._media_listing for h in handlers if h._media_listing is not None]
+    if archiver is not None:
+        futures += list(archiver.running.values())
+    concurrent.futures.wait(futures)
+    for handler in handlers:
+        handler.store_media_listing()
+    if archiver is not None:
+        archiver.store_results()
+
+
+def run_handler(event_loop, server, device_ids, args):
+    """
+    drive the device handlers as a DAQ process would, without the scheduler,
+    return the seconds to create the devices and the cycle durations
+    """
+    start = perf_counter()
+    devices = [Device.objects.get(pk=pk).get_device_instance() for pk in device_ids]
+    init_time = perf_counter() - start
+    handlers = [device._h for device in devices]
+    poller = get_server_poller(server)
+    durations = []
+    for cycle in range(args.cycles):
+        start = perf_counter()
+        # one camera list request per cycle, shared by the handlers
+        poller.last_query = 0
+        start_background(handlers, args)
+        for i, device in enumerate(devices):
+            device._h.poll_now()
+            device.request_data()
+            if args.write_every and i % args.write_every == 0:
+                variable = device.variables[min(device.variables)]
+                device.write_data(variable.pk, write_values(variable, cycle), None)
+        event_loop.run(async_wait_writes())
+        wait_background(event_loop, handlers, args)
+        durations.append(perf_counter() - start)
+    return init_time, durations
+
+
+def run_worker(event_loop, server, device_ids, args):
+    """
+    drive the loop of a multi-camera DAQ process, return the seconds of its
+    init_process and the cycle durations
+    """
+    process = DAQProcess(dt=0, device_ids=device_ids)
+    start = perf_counter()
+    process.init_process()
+    init_time = perf_counter() - start
+    durations = []
+    for cycle in range(args.cycles):
+        tasks = []
+        if args.write_every:
+            for i, device in enumerate(process.devices.values()):
+                if i % args.write_every == 0:
+                    variable = device.variables[min(device.variables)]
+                    tasks.append(
+                        DeviceWriteTask(
+                            variable=variable,
+                            value=write_values(variable, cycle),
+                            start=0,
+                        )
+                    )
+            DeviceWriteTask.objects.bulk_create(tasks)
+        start = perf_counter()
+        handlers = [device._h for device in process.devices.values()]
+        for handler in handlers:
+            handler.poll_now()
+        start_background(handlers, args, process.archiver)
+        process.last_query = 0
+        process.loop()
+        event_loop.run(async_wait_writes())
+        wait_background(event_loop, handlers, args, process.archiver)
+        durations.append(perf_counter() - start)
+    return init_time, durations
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--cameras", default="1,10,100,500")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--mode", choices=["handler", "worker", "both"], default="both")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per fake request"
+    )
+    parser.add_argument(
+        "--payload", type=int, default=0, help="bytes added to each camera config"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="ratio of fake requests answered with an error",
+    )
+    parser.add_argument(
+        "--write-every",
+        type=int,
+        default=10,
+        help="write a variable of one camera out of N per cycle, 0 to disable",
+    )
+    parser.add_argument(
+        "--media",
+        type=int,
+        default=0,
+        help="movies and pictures of each camera, listed and archived at each cycle",
+    )
+    parser.add_argument(
+        "--snapshots",
+        action="store_true",
+        help="fetch a snapshot of each camera at each cycle",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    call_command("migrate", verbosity=0)
+    # send the writes right away, the benchmark waits for them at each cycle
+    GenericDevice.config_write_delay = 0
+    # a new snapshot at each cycle
+    SnapshotSource.min_interval = 0
+
+    event_loop = get_event_loop()
+    fake = FakeMotionEyeServer(
+        latency=args.latency,
+        payload=args.payload,
+        failure_rate=args.failure_rate,
+        port=args.port,
+    )
+    event_loop.run(fake.async_start())
+    archive = tempfile.TemporaryDirectory()
+
+    modes = ["handler", "worker"] if args.mode == "both" else [args.mode]
+    results = []
+    print(
+        "{:<8} {:>7} {:>8} {:>9} {:>9} {:>9} {:>11} {:>8}".format(
+            "mode",
+            "cameras",
+            "init s",
+            "cycles/s",
+            "p50 ms",
+            "p99 ms",
+            "req/cycle",
+            "RSS MB",
+        ),
+        flush=True,
+    )
+    try:
+        for count in [int(c) for c in args.cameras.split(",")]:
+            fake.cameras = count
+            server, device_ids = create_cameras(
+                fake.url, count, archive.name if args.media else ""
+            )
+            add_media(fake, count, args.media)
+            try:
+                for mode in modes:
+                    fake.reset()
+                    run = run_handler if mode == "handler" else run_worker
+                    init_time, durations = run(event_loop, server, device_ids, args)
+                    result = dict(
+                        mode=mode,
+                        cameras=count,
+                        init_s=init_time,
+                        cycles=args.cycles,
+                        cycles_per_second=len(durations) / sum(durations),
+                        p50_ms=percentile(durations, 50) * 1000,
+                        p99_ms=percentile(durations, 99) * 1000,
+                        requests_per_cycle=fake.request_count() / args.cycles,
+                        requests=dict(fake.requests),
+                        rss_mb=rss_mb(),
+                    )
+                    results.append(result)
+                    print(
+                        "{mode:<8} {cameras:>7} {init_s:>8.1f} {cycles_per_second:>9.2f} "
+                        "{p50_ms:>9.1f} {p99_ms:>9.1f} {requests_per_cycle:>11.1f} "
+                        "{rss_mb:>8.1f}".format(**result),
+                        flush=True,
+                    )
+            finally:
+                delete_cameras(server)
+    finally:
+        event_loop.run(fake.async_stop())
+        event_loop.stop()
+        archive.cleanup()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal Django settings for the benchmarks, using a throwaway sqlite database
+"""
+
+import os
+import tempfile
+
+SECRET_KEY = "benchmark"
+DEBUG = False
+USE_TZ = True
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "pyscada.apps.PyScadaConfig",
+    "pyscada.hmi",
+    "pyscada.export",
+    "pyscada.event",
+    "pyscada.mail",
+    "pyscada.log",
+    "pyscada.generic",
+    "pyscada.motioneye",
+]
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get(
+            "BENCHMARK_DB",
+            os.path.join(tempfile.gettempdir(), "motioneye_bench.sqlite3"),
+        ),
+    }
+}
+PYSCADA = {}
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEDIA_ROOT = os.path.join(tempfile.gettempdir(), "motioneye_bench_media")
+STATIC_URL = "/static/"
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "root": {"level": "ERROR"},
+}
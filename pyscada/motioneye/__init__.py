@@ -16,7 +16,7 @@ parent_process_list = [
         "pk": PROTOCOL_ID,
         "label": "pyscada." + __app_name__.lower(),
         "process_class": "pyscada." + __app_name__.lower() + ".worker.Process",
-        "process_class_kwargs": '{"dt_set":30}',
+        "process_class_kwargs": '{"dt_set":30,"group_by":"server","shard_size":0,"metrics_port":0}',
         "enabled": True,
     }
 ]
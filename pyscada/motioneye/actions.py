@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import deque
+
+import asyncio
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# actions moving the camera by one step, a burst of them is kept as a run
+STEP_ACTIONS = ("up", "down", "left", "right", "zoom_in", "zoom_out")
+
+# actions undoing each other when the first one is not sent yet
+OPPOSITE_ACTIONS = {
+    "lock": "unlock",
+    "unlock": "lock",
+    "light_on": "light_off",
+    "light_off": "light_on",
+    "alarm_on": "alarm_off",
+    "alarm_off": "alarm_on",
+    "record_start": "record_stop",
+    "record_stop": "record_start",
+}
+
+
+class ActionQueue:
+    """
+    Actions of a camera waiting to be sent, in the order of the writes. Runs on
+    the event loop.
+    """
+
+    # max number of steps sent for a burst of the same move
+    max_burst = 5
+
+    def __init__(self, async_send, on_done, on_failed):
+        # coroutine function sending an action, True once sent :
+        # async_send(descriptor)
+        self.async_send = async_send
+        # called with the descriptors of the actions sent or cancelled
+        self.on_done = on_done
+        # called with the descriptor of an action that could not be sent
+        self.on_failed = on_failed
+        # [descriptor, count]
+        self.pending = deque()
+        self.task = None
+
+    def put(self, descriptor):
+        action = descriptor.service
+        if len(self.pending):
+            last = self.pending[-1]
+            if last[0].service == action:
+                # same action again before the last one was sent, reported
+                # done with it
+                if action in STEP_ACTIONS:
+                    last[1] = min(last[1] + 1, self.max_burst)
+                return
+            if OPPOSITE_ACTIONS.get(action) == last[0].service:
+                self.pending.pop()
+                self.on_done([last[0], descriptor])
+                return
+        self.pending.append([descriptor, 1])
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.async_run())
+
+    async def async_run(self):
+        try:
+            while len(self.pending):
+                descriptor, count = self.pending.popleft()
+                sent = True
+                try:
+                    for _ in range(count):
+                        if not await self.async_send(descriptor):
+                            sent = False
+                            break
+                except Exception:
+                    logger.warning(
+                        "Cannot send {}".format(descriptor.service), exc_info=True
+                    )
+                    sent = False
+                if sent:
+                    self.on_done([descriptor])
+                else:
+                    self.on_failed(descriptor)
+        finally:
+            self.task = None
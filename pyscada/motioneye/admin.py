@@ -5,11 +5,13 @@ from . import PROTOCOL_ID
 from .models import MotionEyeServer
 from .models import MotionEyeDevice, ExtendedMotionEyeDevice
 from .models import MotionEyeVariable, ExtendedMotionEyeVariable
+from .models import MotionEyeMedia
+from .discovery import discover_cameras, provision_cameras
 from pyscada.admin import DeviceAdmin
 from pyscada.admin import VariableAdmin
 from pyscada.admin import admin_site
 from pyscada.models import Device, DeviceProtocol
-from django.contrib import admin
+from django.contrib import admin, messages
 import logging
 
 logger = logging.getLogger(__name__)
@@ -68,6 +70,43 @@ class MotionEyeVariableAdmin(VariableAdmin):
     inlines = [MotionEyeVariableAdminInline]
 
 
+class MotionEyeServerAdmin(admin.ModelAdmin):
+    actions = ["discover_cameras"]
+
+    @admin.action(description="Add the cameras not yet in PyScada")
+    def discover_cameras(self, request, queryset):
+        for server in queryset:
+            try:
+                devices = provision_cameras(server, discover_cameras(server))
+            except Exception as e:
+                logger.warning(f"Discovery failed for {server}", exc_info=True)
+                self.message_user(
+                    request,
+                    f"Cannot read the cameras of {server} : {e}",
+                    messages.ERROR,
+                )
+                continue
+            self.message_user(request, f"{len(devices)} camera(s) added for {server}")
+
+
+class MotionEyeMediaAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "motioneye_device",
+        "kind",
+        "path",
+        "timestamp",
+        "size",
+        "archived",
+    )
+    list_filter = ("motioneye_device", "kind", ("archived", admin.EmptyFieldListFilter))
+    date_hierarchy = "timestamp"
+
+    def has_add_permission(self, request):
+        # filled by the DAQ process
+        return False
+
+
 class MotionEyeDeviceAdmin2(admin.ModelAdmin):
     save_as = True
     save_as_continue = True
@@ -79,4 +118,5 @@ class MotionEyeDeviceAdmin2(admin.ModelAdmin):
 # admin_site.register(ExtendedMotionEyeDevice, MotionEyeDeviceAdmin)
 # admin_site.register(ExtendedMotionEyeVariable, MotionEyeVariableAdmin)
 admin_site.register(MotionEyeDevice, MotionEyeDeviceAdmin2)
-admin_site.register(MotionEyeServer)
+admin_site.register(MotionEyeServer, MotionEyeServerAdmin)
+admin_site.register(MotionEyeMedia, MotionEyeMediaAdmin)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+# imported by the analysis processes, keep it free of Django imports
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import multiprocessing
+
+import asyncio
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    from PIL import Image
+
+    analysis_ok = True
+except ImportError:
+    logger.info("numpy and Pillow are needed for the image analysis")
+    analysis_ok = False
+
+# max width and height in pixels of the analysed frames
+FRAME_SIZE = 160
+# min luma difference of a pixel counted as activity, above the sensor noise
+DIFF_THRESHOLD = 15
+# processes decoding and analysing the frames of all the cameras
+ANALYSIS_WORKERS = 1
+
+
+def analyse_frame(data, previous=None):
+    """
+    decode a downscaled grey JPEG, return it with the percentage of pixels
+    changed since the previous frame (None without previous frame) and the
+    mean luma from 0 to 255
+    """
+    image = Image.open(BytesIO(data))
+    # let the JPEG decoder scale down by a power of 2 before the resize
+    image.draft("L", (FRAME_SIZE, FRAME_SIZE))
+    image = image.convert("L")
+    image.thumbnail((FRAME_SIZE, FRAME_SIZE))
+    frame = np.asarray(image, dtype=np.int16)
+    brightness = float(frame.mean())
+    activity = None
+    if previous is not None and previous.shape == frame.shape:
+        changed = np.count_nonzero(np.abs(frame - previous) > DIFF_THRESHOLD)
+        activity = 100.0 * changed / frame.size
+    return frame, activity, brightness
+
+
+_pool = None
+
+
+def get_process_pool():
+    global _pool
+    if _pool is None:
+        # spawned, a fork would copy the DAQ process and its threads
+        _pool = ProcessPoolExecutor(
+            ANALYSIS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def async_shutdown_process_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+class FrameAnalyser:
+    """
+    Analyse the snapshots of a camera every period seconds in the process pool.
+    Runs on the event loop.
+    """
+
+    def __init__(self):
+        # SnapshotSource of the camera
+        self.source = None
+        self.period = 0
+        # called on the loop with {service: value}
+        self.publish = None
+        self.previous = None
+        self.last_etag = None
+        self.task = None
+
+    def configure(self, source, period, publish):
+        self.source = source
+        self.period = period
+        self.publish = publish
+        if self.period and self.task is None:
+            self.task = asyncio.ensure_future(self.async_run())
+
+    async def async_run(self):
+        try:
+            while self.period:
+                try:
+                    await self.async_analyse()
+                except Exception as e:
+                    logger.debug(
+                        "Analysis of camera {} of {} failed : {}".format(
+                            self.source.camera_id, self.source.server, e
+                        )
+                    )
+                await asyncio.sleep(self.period)
+        finally:
+            self.task = None
+
+    async def async_analyse(self):
+        frame = await self.source.async_get(max_age=self.period)
+        if frame.etag == self.last_etag:
+            # same image as the last analysis
+            self.publish(dict(activity=0.0))
+            return
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            get_process_pool(), analyse_frame, frame.data, self.previous
+        )
+        self.previous, activity, brightness = result
+        self.last_etag = frame.etag
+        values = dict(brightness=brightness)
+        if activity is not None:
+            values["activity"] = activity
+        self.publish(values)
+
+
+# device id -> FrameAnalyser, kept when the device handler is created again
+_analysers = {}
+
+
+async def async_get_frame_analyser(device_id, source, period, publish):
+    """
+    return the analyser of a camera device
+    """
+    if device_id not in _analysers:
+        _analysers[device_id] = FrameAnalyser()
+    _analysers[device_id].configure(source, period, publish)
+    return _analysers[device_id]
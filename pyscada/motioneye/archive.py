@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .models import MotionEyeMedia
+from .pool import client_pool
+from .server import get_server_poller, CircuitOpenError
+
+from django.utils.timezone import now
+
+from datetime import timedelta
+from time import time
+import hashlib
+import os
+import re
+
+import asyncio
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# bytes read from motionEye and written to the disk at a time
+CHUNK_SIZE = 256 * 1024
+# seconds after its last modification before a movie is downloaded, motion may
+# still be writing it
+ARCHIVE_DELAY = 120
+
+
+class DownloadError(Exception):
+    """
+    raised when a downloaded file does not match what the server announced
+    """
+
+
+def archive_path(archive_dir, motioneye_device_id, path):
+    """
+    return the local path of a media, inside the folder of its device
+    """
+    root = os.path.abspath(
+        os.path.join(archive_dir, "device-{}".format(motioneye_device_id))
+    )
+    target = os.path.abspath(os.path.join(root, path.lstrip("/")))
+    if not target.startswith(root + os.sep):
+        raise DownloadError("{} is outside of the archive folder".format(path))
+    return target
+
+
+def hash_file(path, digest=None):
+    if digest is None:
+        digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def write_chunk(f, digest, chunk):
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def content_range(response):
+    """
+    return (first byte, total size) of a partial response, None if unknown
+    """
+    match = re.match(
+        r"bytes (\d+|\*)(?:-\d+)?/(\d+|\*)", response.headers.get("Content-Range", "")
+    )
+    if match is None:
+        return None, None
+    first, total = match.groups()
+    return (
+        None if first == "*" else int(first),
+        None if total == "*" else int(total),
+    )
+
+
+# MotionEyeServer id -> (max downloads, Semaphore)
+_semaphores = {}
+
+
+def get_download_semaphore(server):
+    """
+    return the semaphore limiting the concurrent downloads from a server
+    """
+    limit = max(server.max_downloads, 1)
+    if server.pk not in _semaphores or _semaphores[server.pk][0] != limit:
+        _semaphores[server.pk] = (limit, asyncio.Semaphore(limit))
+    return _semaphores[server.pk][1]
+
+
+async def async_download_movie(server, camera_id, path, target):
+    """
+    stream a movie to target, resuming the target.part file of a previous
+    attempt, return its size and sha256
+    """
+    async with get_download_semaphore(server):
+        # only the polls probe a server whose circuit is open, a download does
+        # not record its outcome
+        breaker = get_server_poller(server).breaker
+        if breaker.state != "closed":
+            raise CircuitOpenError(breaker.reason(server))
+        return await _async_download_movie(server, camera_id, path, target)
+
+
+async def _async_download_movie(server, camera_id, path, target):
+    loop = asyncio.get_running_loop()
+    part = target + ".part"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    digest = hashlib.sha256()
+    if offset:
+        digest = await loop.run_in_executor(None, hash_file, part, digest)
+
+    pooled = client_pool.get(server)
+    await pooled.async_ensure_login()
+    async with pooled.client.async_get_media_stream(
+        camera_id,
+        path,
+        image=False,
+        range_header="bytes={}-".format(offset) if offset else None,
+    ) as response:
+        first, total = content_range(response)
+        if response.status == 416:
+            # nothing after the part file
+            if total != offset:
+                os.remove(part)
+                raise DownloadError("{} is larger than the movie".format(part))
+        else:
+            if response.status != 206 or first != offset:
+                # whole file sent
+                offset = 0
+                digest = hashlib.sha256()
+                total = response.response.content_length
+            with open(part, "ab" if offset else "wb") as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    await loop.run_in_executor(None, write_chunk, f, digest, chunk)
+
+    size = os.path.getsize(part)
+    if total is not None and size != total:
+        raise DownloadError("{} bytes received out of {}".format(size, total))
+    # read the file back, the disk must hold what was received
+    if (await loop.run_in_executor(None, hash_file, part)).digest() != digest.digest():
+        os.remove(part)
+        raise DownloadError("checksum of {} does not match".format(part))
+    os.replace(part, target)
+    return size, digest.hexdigest()
+
+
+class Archiver:
+    """
+    Download the indexed movies of the devices of a DAQ process to the archive
+    folder of their server. The downloads run on the event loop, the database
+    is only queried from the DAQ process thread.
+    """
+
+    # seconds between two queries of the movies to download
+    check_interval = 60
+    # max movies waiting for or being downloaded by a DAQ process
+    max_queued = 20
+
+    def __init__(self, event_loop):
+        self.event_loop = event_loop
+        self.next_check = 0
+        # MotionEyeMedia id -> concurrent.futures.Future of the download
+        self.running = dict()
+
+    def run(self, device_ids):
+        self.store_results()
+        if time() < self.next_check or len(self.running) >= self.max_queued:
+            return
+        self.next_check = time() + self.check_interval
+        pending = (
+            MotionEyeMedia.objects.filter(
+                motioneye_device__motioneye_device_id__in=device_ids,
+                motioneye_device__archive_movies=True,
+                kind="movie",
+                archived__isnull=True,
+                timestamp__lt=now() - timedelta(seconds=ARCHIVE_DELAY),
+            )
+            .exclude(motioneye_device__motioneye_server__archive_dir="")
+            .exclude(pk__in=list(self.running))
+            .select_related("motioneye_device__motioneye_server")
+            .order_by("timestamp")
+        )
+        for media in pending[: self.max_queued - len(self.running)]:
+            device = media.motioneye_device
+            try:
+                target = archive_path(
+                    device.motioneye_server.archive_dir, device.pk, media.path
+                )
+            except DownloadError as e:
+                logger.warning("Cannot archive {} : {}".format(media, e))
+                continue
+            self.running[media.pk] = self.event_loop.submit(
+                async_download_movie(
+                    device.motioneye_server, device.camera_id, media.path, target
+                )
+            )
+
+    def store_results(self):
+        for pk, future in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[pk]
+            try:
+                size, sha256 = future.result()
+            except CircuitOpenError:
+                continue
+            except Exception as e:
+                logger.info("Download of media {} failed : {}".format(pk, e))
+                continue
+            MotionEyeMedia.objects.filter(pk=pk).update(
+                size=size, sha256=sha256, archived=now()
+            )
+
+    def cancel(self):
+        """
+        cancel the running downloads, resumed from their part file by the next
+        process
+        """
+        for future in self.running.values():
+            future.cancel()
+        self.running.clear()
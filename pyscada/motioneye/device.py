@@ -32,3 +32,6 @@ class Device(GenericDevice):
             if not hasattr(var, "motioneyevariable"):
                 continue
             self.variables[var.pk] = var
+
+        if self.driver_handler_ok and hasattr(self._h, "build_descriptors"):
+            self._h.build_descriptors()
@@ -3,26 +3,43 @@
 # from https://github.com/home-assistant/core/tree/dev/homeassistant/components/motioneye
 from __future__ import unicode_literals
 from .. import PROTOCOL_ID
-from pyscada.models import DeviceProtocol, VariableProperty
+from ..server import get_server_poller, CircuitOpenError
+from ..metrics import metrics
+from ..actions import ActionQueue
+from ..loop import get_event_loop
+from ..webserver import web_server
+from ..snapshots import async_get_snapshot_source
+from ..analysis import (
+    analysis_ok,
+    async_get_frame_analyser,
+    async_shutdown_process_pool,
+)
+from ..streams import get_stream_relay
+from ..pool import client_pool
+from ..media import MEDIA_LIST_METHODS, RELIST_MARGIN, async_list_media
+from ..models import MotionEyeVariable, MotionEyeMedia, SERVICE_CODECS
+from pyscada.models import DeviceProtocol, VariableProperty, RecordedData
 from pyscada.device import GenericHandlerDevice
 
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils.timezone import now
+
 import traceback
-import re
+from collections import namedtuple
+import hmac
+from datetime import timedelta
+from threading import Lock
 from time import time
 import json
-from typing import Any
 
-from asgiref.sync import async_to_sync
-from async_timeout import timeout
-from asyncio import wait_for
+import asyncio
 
 try:
     from asyncio.exceptions import TimeoutError as asyncioTimeoutError
-    from asyncio.exceptions import CancelledError as asyncioCancelledError
 except ModuleNotFoundError:
     # for python version < 3.8
     from asyncio import TimeoutError as asyncioTimeoutError
-    from asyncio import CancelledError as asyncioCancelledError
 
 import logging
 
@@ -30,6 +47,7 @@ logger = logging.getLogger(__name__)
 
 try:
     from motioneye_client.client import *
+    from motioneye_client.const import *
 
     driver_ok = True
 except ImportError:
@@ -39,24 +57,15 @@ except ImportError:
 
 async def async_set_cameras_config(device, conf):
     try:
-        url = device.motioneye_server.url
-        admin_username = device.motioneye_server.admin_username
-        admin_password = device.motioneye_server.admin_password
-        surveillance_username = device.motioneye_server.surveillance_username
-        surveillance_password = device.motioneye_server.surveillance_password
-        async with MotionEyeClient(
-            url,
-            admin_username,
-            admin_password,
-            surveillance_username,
-            surveillance_password,
-        ) as client:
-            try:
-                await wait_for(
-                    client.async_set_camera(device.camera_id, conf), timeout=5
-                )
-            except (TimeoutError, asyncioTimeoutError):
-                logger.warning("Timeout for {}.".format(device))
+        try:
+            await get_server_poller(device.motioneye_server).async_call(
+                "async_set_camera", device.camera_id, conf, camera=device.camera_id
+            )
+            return True
+        except (TimeoutError, asyncioTimeoutError):
+            logger.warning("Timeout for {}.".format(device))
+    except CircuitOpenError as e:
+        logger.info("Write skipped for {} : {}".format(device, e))
     except MotionEyeClientInvalidAuthError:
         logger.warning("Invalid motionEye authentication for {}.".format(device))
     except MotionEyeClientConnectionError:
@@ -72,24 +81,17 @@ async def async_set_cameras_config(device, conf):
 
 async def async_do_action(device, camera_id, action):
     try:
-        url = device.motioneye_server.url
-        admin_username = device.motioneye_server.admin_username
-        admin_password = device.motioneye_server.admin_password
-        surveillance_username = device.motioneye_server.surveillance_username
-        surveillance_password = device.motioneye_server.surveillance_password
-        async with MotionEyeClient(
-            url,
-            admin_username,
-            admin_password,
-            surveillance_username,
-            surveillance_password,
-        ) as client:
-            try:
-                await wait_for(client.async_action(camera_id, action), timeout=5)
-            except (TimeoutError, asyncioTimeoutError):
-                logger.warning("Timeout for {}.".format(device))
+        try:
+            await get_server_poller(device.motioneye_server).async_call(
+                "async_action", camera_id, action, camera=camera_id
+            )
+        except (TimeoutError, asyncioTimeoutError):
+            logger.warning("Timeout for {}.".format(device))
+            return None
         # Set the action variable to False to be settable again
         return False
+    except CircuitOpenError as e:
+        logger.info("Action skipped for {} : {}".format(device, e))
     except MotionEyeClientInvalidAuthError:
         logger.warning("Invalid motionEye authentication for {}.".format(device))
     except MotionEyeClientConnectionError:
@@ -103,13 +105,160 @@ async def async_do_action(device, camera_id, action):
     return None
 
 
+VariableDescriptor = namedtuple(
+    "VariableDescriptor", ["variable", "service", "kind", "codec", "camera_id"]
+)
+
+
 class GenericDevice(GenericHandlerDevice):
+    # max age in seconds of the cached camera config used to write,
+    # None to always write over the config of the last poll
+    camera_config_max_age = 60
+    # seconds to wait for other writes to the same camera before sending them
+    # in one set_camera request
+    config_write_delay = 0.5
+    # seconds after which a stored file event, or a motion event without motion
+    # end hook, goes back to False
+    event_reset_delay = 30
+    # unchanged polls after which the poll interval of the camera doubles, up
+    # to the max_poll_interval of the MotionEyeDevice
+    idle_cycles = 3
+    # seconds of polling at the min interval after a write, an action, an
+    # event or a change made outside of PyScada
+    fast_poll_duration = 60
+
     def __init__(self, pyscada_device, variables):
         super().__init__(pyscada_device, variables)
         self._protocol = PROTOCOL_ID
         self.driver_ok = driver_ok
         self.camera_config = None
+        self.camera_config_time = 0
         self.last_value = None
+        self.loop = get_event_loop()
+        # resolve the relations here, the loop thread must not query the DB
+        self._motioneye_device = pyscada_device.motioneyedevice
+        self._motioneye_server = self._motioneye_device.motioneye_server
+        # config keys written since the last known server state, not sent yet
+        self._dirty_config = dict()
+        # running flush, a single one at a time so that each request is built
+        # over the keys sent before
+        self._flush_task = None
+        # key -> (value, time) of the sent keys, kept over the polls started
+        # before the server applied them
+        self._written_config = dict()
+        # keys of the request being sent
+        self._inflight_config = dict()
+        # variable id -> VariableDescriptor
+        self._descriptors = dict()
+        # service -> VariableDescriptor for the web hook events and the analysis
+        self._event_descriptors = dict()
+        self._event_timers = dict()
+        self._event_lock = Lock()
+        # SnapshotSource of the camera, served by the web server
+        self.snapshots = None
+        self._action_queue = ActionQueue(
+            self.async_send_action, self.action_done, self.action_failed
+        )
+        # variable ids of the actions sent or cancelled, set back to False by
+        # the next read
+        self._done_actions = set()
+        self._actions_lock = Lock()
+        # adaptive polling
+        self._last_poll = 0
+        self._unchanged_cycles = 0
+        self._fast_poll_until = 0
+        self._config_fingerprint = None
+        # camera config and variables of the last read, to read only changes
+        self._read_config = None
+        self._read_fingerprint = None
+        self._read_variable_ids = set()
+        self._last_full_read = 0
+        # media index : kind -> datetime from which the next listing starts
+        self._media_high_water = None
+        self._next_media_index = 0
+        # concurrent.futures.Future of the running listing
+        self._media_listing = None
+        analysis_period = self._motioneye_device.analysis_period
+        if analysis_period and not analysis_ok:
+            logger.warning(
+                "Install numpy and Pillow to analyse the images of {}".format(
+                    self._device
+                )
+            )
+            analysis_period = 0
+        if self._motioneye_server is not None:
+            self.snapshots = self.loop.run(
+                async_get_snapshot_source(
+                    self._device.pk,
+                    self._motioneye_server,
+                    self._motioneye_device.camera_id,
+                    self._motioneye_device.snapshot_buffer_size,
+                    self._motioneye_device.snapshot_period,
+                )
+            )
+        if self.snapshots is not None and analysis_ok:
+            # also stops the analysis of a device whose period is set to 0
+            self.loop.run(
+                async_get_frame_analyser(
+                    self._device.pk, self.snapshots, analysis_period, self.push_analysis
+                )
+            )
+            if analysis_period:
+                self.loop.on_stop(async_shutdown_process_pool)
+        # web hooks, snapshots and stream served by the DAQ process
+        web_server.register(self._device.pk, self)
+
+    def min_poll_interval(self):
+        return self._motioneye_device.min_poll_interval or self._device.polling_interval
+
+    def poll_interval(self):
+        """
+        seconds until the next poll of the camera : the min interval during a
+        fast window, doubled every idle_cycles unchanged polls up to the max
+        interval otherwise
+        """
+        min_interval = self.min_poll_interval()
+        max_interval = self._motioneye_device.max_poll_interval
+        if time() < self._fast_poll_until or max_interval <= min_interval:
+            return min_interval
+        steps = min(self._unchanged_cycles // max(self.idle_cycles, 1), 16)
+        return min(max_interval, min_interval * 2**steps)
+
+    def is_poll_due(self):
+        return time() - self._last_poll >= self.poll_interval()
+
+    def poll_fast(self):
+        """
+        poll at the min interval for fast_poll_duration seconds
+        """
+        self._fast_poll_until = time() + self.fast_poll_duration
+        self._unchanged_cycles = 0
+
+    def poll_now(self):
+        """
+        poll on the next read, e.g. for a DeviceReadTask
+        """
+        self._last_poll = 0
+
+    def update_poll_schedule(self):
+        if self.camera_config is None:
+            # retry at the min interval until the camera answers
+            self._unchanged_cycles = 0
+            return
+        fingerprint = json.dumps(self.camera_config, sort_keys=True, default=str)
+        if fingerprint == self._config_fingerprint:
+            self._unchanged_cycles += 1
+        else:
+            if self._config_fingerprint is not None:
+                # changed outside of PyScada
+                self.poll_fast()
+            self._unchanged_cycles = 0
+            self._config_fingerprint = fingerprint
+
+    def before_read(self):
+        if not self.is_poll_due():
+            return False
+        return self.connect()
 
     def connect(self):
         """
@@ -117,187 +266,624 @@ class GenericDevice(GenericHandlerDevice):
         """
         super().connect()
 
-        async_to_sync(self.async_get_cameras_config)()
+        self._last_poll = time()
+        self.loop.run(self.async_get_cameras_config())
+        self.update_poll_schedule()
+        if self.camera_config is not None and self._motioneye_server.webhook_url:
+            # registered again if a write failed or the hooks changed in motionEye
+            updates = {
+                key: value
+                for key, value in self.webhook_config().items()
+                if key in self.camera_config
+                and str(self.camera_config[key]) != str(value)
+            }
+            if len(updates):
+                self.loop.run(self.async_queue_config(updates))
 
         self.accessibility()
         return True
 
+    def webhook_config(self):
+        """
+        camera config keys making motionEye call this worker on motion and
+        stored files
+        """
+        url = self._motioneye_server.webhook_url.rstrip("/") + "/motioneye/{}/".format(
+            self._device.pk
+        )
+        token = self._motioneye_server.webhook_token
+        query = "?token={}".format(token) if token else ""
+
+        def hook_url(event, params=""):
+            # the motionEye conversion specifiers of the params are not encoded
+            if params:
+                return url + event + (query + "&" if query else "?") + params
+            return url + event + query
+
+        conf = {
+            KEY_WEB_HOOK_NOTIFICATIONS_ENABLED: True,
+            KEY_WEB_HOOK_NOTIFICATIONS_HTTP_METHOD: KEY_HTTP_METHOD_GET,
+            KEY_WEB_HOOK_NOTIFICATIONS_URL: hook_url("motion_start"),
+            KEY_WEB_HOOK_STORAGE_ENABLED: True,
+            KEY_WEB_HOOK_STORAGE_HTTP_METHOD: KEY_HTTP_METHOD_GET,
+            KEY_WEB_HOOK_STORAGE_URL: hook_url(
+                "file_stored",
+                "file_type={}".format(
+                    KEY_WEB_HOOK_CONVERSION_SPECIFIERS[KEY_WEB_HOOK_CS_FILE_TYPE]
+                ),
+            ),
+        }
+        # motion end hooks are only available in recent motionEye versions
+        if "web_hook_end_notifications_enabled" in self.camera_config:
+            conf["web_hook_end_notifications_enabled"] = True
+            conf["web_hook_end_notifications_http_method"] = KEY_HTTP_METHOD_GET
+            conf["web_hook_end_notifications_url"] = hook_url("motion_end")
+        return conf
+
+    def has_motion_end_hook(self):
+        """
+        return True if motionEye calls this worker when a motion ends
+        """
+        return (
+            self.camera_config is not None
+            and bool(self.camera_config.get("web_hook_end_notifications_enabled"))
+            and self.camera_config.get("web_hook_end_notifications_url")
+            == self.webhook_config().get("web_hook_end_notifications_url")
+        )
+
+    def is_token_valid(self, token):
+        """
+        return True if a web request carries the web hook token of the server
+        """
+        expected = getattr(self._motioneye_server, "webhook_token", "")
+        if not expected:
+            return True
+        return hmac.compare_digest(
+            expected.encode(), str(token or "").encode("utf-8", "replace")
+        )
+
+    async def async_get_stream_url(self):
+        """
+        return the MJPEG stream url of the camera, None if it does not stream
+        """
+        camera_config = await self.async_get_camera_config()
+        if camera_config is None:
+            return None
+        return client_pool.get(self._motioneye_server).client.get_camera_stream_url(
+            camera_config
+        )
+
+    def stream_relay(self):
+        """
+        return the relay shared by the viewers of the camera stream, to call on
+        the loop
+        """
+        return get_stream_relay(
+            self._motioneye_device.pk,
+            self._motioneye_server,
+            self._motioneye_device.camera_id,
+            self.async_get_stream_url,
+        )
+
+    def push_event(self, event, params):
+        """
+        called on the loop by the web server when motionEye calls a web hook
+        """
+        values = dict()
+        if event == "motion_start":
+            values["motion_detected"] = 1
+        elif event == "motion_end":
+            values["motion_detected"] = 0
+        elif event == "file_stored":
+            try:
+                file_type = int(params.get(KEY_WEB_HOOK_CS_FILE_TYPE, 0))
+            except ValueError:
+                file_type = 0
+            if MotionEyeClient.is_file_type_image(file_type):
+                values["picture_stored"] = 1
+            else:
+                values["movie_stored"] = 1
+            # index it on the next poll
+            self._next_media_index = 0
+        elif event.endswith("_reset"):
+            values[event[: -len("_reset")]] = 0
+        else:
+            logger.info("Unknown event {} for {}".format(event, self._device))
+            return None
+
+        self.poll_fast()
+        timestamp = self.time()
+        variables = []
+        for service, value in values.items():
+            if service in self._event_timers:
+                self._event_timers.pop(service).cancel()
+            if value and not (
+                service == "motion_detected" and self.has_motion_end_hook()
+            ):
+                self._event_timers[service] = self.loop.loop.call_later(
+                    self.event_reset_delay, self.push_event, service + "_reset", {}
+                )
+            if service in self._event_descriptors:
+                variables.append((self._event_descriptors[service].variable, value))
+        if len(variables):
+            self.loop.loop.run_in_executor(
+                None, self.store_event_values, variables, timestamp
+            )
+
+    def push_analysis(self, values):
+        """
+        called on the loop with the activity and brightness of a new snapshot
+        """
+        variables = [
+            (self._event_descriptors[service].variable, value)
+            for service, value in values.items()
+            if service in self._event_descriptors
+        ]
+        if len(variables):
+            self.loop.loop.run_in_executor(
+                None, self.store_event_values, variables, self.time()
+            )
+
+    def store_event_values(self, variables, timestamp):
+        """
+        store the event values right away instead of waiting for the next poll
+        """
+        with self._event_lock:
+            items = []
+            for var, value in variables:
+                if var.update_value(value, timestamp):
+                    item = var.create_recorded_data_element()
+                    if item is not None:
+                        item.date_saved = now()
+                        items.append(item)
+            try:
+                RecordedData.objects.bulk_create(items, ignore_conflicts=True)
+            except Exception:
+                logger.warning(
+                    "Cannot store the events of {}".format(self._device), exc_info=True
+                )
+            finally:
+                close_old_connections()
+
+    def build_descriptors(self):
+        """
+        resolve once what reads and writes need to know about each variable
+        """
+        descriptors = dict()
+        action_services = dict(MotionEyeVariable.service_actions_choices)
+        event_services = dict(MotionEyeVariable.service_event_choices)
+        analysis_services = dict(MotionEyeVariable.service_analysis_choices)
+        for var in self._variables.values():
+            service = var.motioneyevariable.service
+            if service in action_services:
+                kind = "action"
+            elif service in event_services:
+                kind = "event"
+            elif service in analysis_services:
+                kind = "analysis"
+            else:
+                kind = "config"
+            descriptors[var.pk] = VariableDescriptor(
+                variable=var,
+                service=service,
+                kind=kind,
+                codec=SERVICE_CODECS[service],
+                camera_id=self._motioneye_device.camera_id,
+            )
+        self._descriptors = descriptors
+        self._event_descriptors = {
+            d.service: d
+            for d in descriptors.values()
+            if d.kind in ["event", "analysis"]
+        }
+        return descriptors
+
+    def get_descriptor(self, variable_id):
+        if variable_id not in self._descriptors and variable_id in self._variables:
+            # variable added after the handler init
+            self.build_descriptors()
+        return self._descriptors.get(variable_id)
+
+    def read_data_all(self, variables_dict):
+        output = self.read_done_actions(variables_dict)
+        self.store_media_listing()
+
+        if self.before_read():
+            for item in self.variables_to_read(variables_dict):
+                value, read_time = self.read_data_and_time(item)
+
+                if value is not None and item.update_value(value, read_time):
+                    output.append(item.create_recorded_data_element())
+            self.index_media()
+        self.after_read()
+        return output
+
+    def read_done_actions(self, variables_dict):
+        """
+        set the variables of the actions sent or cancelled back to False,
+        after the value of their write
+        """
+        with self._actions_lock:
+            variable_ids = self._done_actions
+            self._done_actions = set()
+        output = []
+        for variable_id in variable_ids:
+            item = variables_dict.get(variable_id)
+            if item is not None and item.update_value(0, time()):
+                output.append(item.create_recorded_data_element())
+        return output
+
+    def index_media(self):
+        """
+        list the movies and pictures stored since the last index in the
+        background, every media_index_interval seconds
+        """
+        interval = self._motioneye_device.media_index_interval
+        if not interval or self.camera_config is None:
+            return
+        if self._media_listing is not None or time() < self._next_media_index:
+            return
+        self._next_media_index = time() + interval
+        if self._media_high_water is None:
+            self._media_high_water = dict(
+                MotionEyeMedia.objects.filter(motioneye_device=self._motioneye_device)
+                .values("kind")
+                .annotate(Max("timestamp"))
+                .values_list("kind", "timestamp__max")
+            )
+        self._media_listing = self.loop.submit(
+            self.async_list_new_media(
+                dict(self.camera_config), dict(self._media_high_water)
+            )
+        )
+
+    async def async_list_new_media(self, camera_config, high_water):
+        """
+        list the kinds of media concurrently, return the start of the listing
+        and kind -> entries, or the exception of a failed listing
+        """
+        kinds = list(MEDIA_LIST_METHODS)
+        started = now()
+        results = await asyncio.gather(
+            *[
+                # the newest media is listed again, it may still be written
+                async_list_media(
+                    self._motioneye_server,
+                    self._motioneye_device.camera_id,
+                    kind,
+                    camera_config,
+                    high_water.get(kind),
+                )
+                for kind in kinds
+            ],
+            return_exceptions=True,
+        )
+        return started, dict(zip(kinds, results))
+
+    def store_media_listing(self):
+        """
+        add the media of a finished listing to the MotionEyeMedia
+        """
+        if self._media_listing is None or not self._media_listing.done():
+            return
+        listing = self._media_listing
+        self._media_listing = None
+        try:
+            started, results = listing.result()
+        except BaseException as e:
+            logger.info("Cannot list the media of {} : {}".format(self._device, e))
+            return
+        for kind, entries in results.items():
+            if isinstance(entries, BaseException):
+                logger.info(
+                    "Cannot list the {}s of {} : {}".format(kind, self._device, entries)
+                )
+                continue
+            # after a listing, even an empty one, the next one only covers the
+            # date folders from this day
+            self._media_high_water[kind] = max(
+                [e[1] for e in entries] + [started - timedelta(seconds=RELIST_MARGIN)]
+            )
+            if not len(entries):
+                continue
+            MotionEyeMedia.objects.bulk_create(
+                [
+                    MotionEyeMedia(
+                        motioneye_device=self._motioneye_device,
+                        kind=kind,
+                        path=path,
+                        timestamp=timestamp,
+                        size=size,
+                    )
+                    for path, timestamp, size in entries
+                ],
+                update_conflicts=True,
+                unique_fields=["motioneye_device", "kind", "path"],
+                update_fields=["timestamp", "size"],
+            )
+
+    def variables_to_read(self, variables_dict):
+        """
+        return the variables whose motionEye key changed since the last read,
+        all of them every full_refresh_interval seconds
+        """
+        if self.camera_config is None:
+            return []
+        full_refresh_interval = self._motioneye_device.full_refresh_interval
+        if (
+            self._read_config is None
+            or set(variables_dict) != self._read_variable_ids
+            or time() - self._last_full_read >= full_refresh_interval
+        ):
+            variables = list(variables_dict.values())
+            self._last_full_read = time()
+        elif self._config_fingerprint == self._read_fingerprint:
+            # same camera config as the last read
+            variables = []
+        else:
+            variables = []
+            for item in variables_dict.values():
+                descriptor = self.get_descriptor(item.pk)
+                if descriptor is not None and self.camera_config.get(
+                    descriptor.service
+                ) != self._read_config.get(descriptor.service):
+                    variables.append(item)
+        self._read_config = dict(self.camera_config)
+        self._read_fingerprint = self._config_fingerprint
+        self._read_variable_ids = set(variables_dict)
+        return variables
+
     def read_data(self, variable_instance):
         """
         read values from the device
         """
         value = None
+        descriptor = self.get_descriptor(variable_instance.pk)
         if (
-            self.camera_config is not None
-            and variable_instance.motioneyevariable.service in self.camera_config
+            descriptor is not None
+            and descriptor.kind == "config"
+            and self.camera_config is not None
+            and descriptor.service in self.camera_config
         ):
-            value = self.camera_config[variable_instance.motioneyevariable.service]
+            value = self.camera_config[descriptor.service]
+            if descriptor.codec["field"] != "boolean":
+                # motionEye string to the value of the PyScada dictionary
+                value = descriptor.codec["reverse"].get(str(value))
         return value
 
     def write_data(self, variable_id, value, task):
         """
-        write values to the device
-        """
-        if self.connect():
-            for var in self._variables:
-                var = self._variables[var]
-                if variable_id == var.id:
-                    if (
-                        self.camera_config is not None
-                        and var.motioneyevariable.service in self.camera_config
-                    ):
-                        # Config
-                        if var.value_class == "BOOLEAN":
-                            value = str(bool(value))
-                        else:
-                            for field in var.motioneyevariable.service_not_boolean:
-                                if re.compile(field, re.IGNORECASE).match(
-                                    var.motioneyevariable.service
-                                ):
-                                    # if field in var.motioneyevariable.service:
-                                    value = str(
-                                        var.motioneyevariable.service_not_boolean[
-                                            field
-                                        ][int(value)][0]
-                                    )
-
-                                # for custom text overlay
-                                if int(value) == 2:
-                                    if "left" in var.motioneyevariable.service:
-                                        try:
-                                            self.camera_config[
-                                                "custom_"
-                                                + var.motioneyevariable.service
-                                            ] = str(
-                                                var.variableproperty_set.get(
-                                                    name="text"
-                                                ).value()
-                                            )
-                                        except VariableProperty.DoesNotExist:
-                                            logger.warning(
-                                                "VariableProperty named text does not exist "
-                                                "for custom text overlay var id {}".format(
-                                                    var.id
-                                                )
-                                            )
-
-                        self.camera_config[var.motioneyevariable.service] = value
-
-                        async_to_sync(async_set_cameras_config)(
-                            var.device.motioneyedevice, self.camera_config
-                        )
-
-                        return value
-                    else:
-                        # Actions
-                        for action in var.motioneyevariable.service_actions_choices:
-                            if var.motioneyevariable.service == action[0]:
-                                value = async_to_sync(async_do_action)(
-                                    var.device.motioneyedevice,
-                                    var.device.motioneyedevice.camera_id,
-                                    str(action[0]),
-                                )
-                                return value
-
-                        logger.info(
-                            "write {} failed for {}".format(
-                                var.motioneyevariable.service, var.device
-                            )
-                        )
-                        return None
-
+        write values to the device, using the camera config of the last poll
+        """
+        if not self.driver_ok:
+            return None
+        descriptor = self.get_descriptor(variable_id)
+        if descriptor is None:
             logger.warning(
                 "Variable {} not in variable list {} of device {}".format(
                     variable_id, self._variables, self._device
                 )
             )
-        return None
+            return None
 
-    async def async_get_cameras_config(self):
-        # Refresh cameras configurations
-        self.inst = None
-        self.camera_config = None
-        try:
-            self.inst = await self.async_query_motioneye_server()
-            if (
-                type(self.inst) == dict
-                and "cameras" in self.inst
-                and type(self.inst["cameras"]) == dict
-                and "cameras" in self.inst["cameras"]
-            ):
-                for camera in self.inst["cameras"]["cameras"]:
-                    if camera["id"] == self._device.motioneyedevice.camera_id:
-                        self.camera_config = camera
-        except (TimeoutError, asyncioTimeoutError):
-            self._not_accessible_reason = "Timeout"
-        except Exception as e:
-            self._not_accessible_reason = e
-            # logger.warning(traceback.format_exc())
-
-    async def async_query_motioneye_server(self) -> dict[str, Any] or None:
-        try:
-            url = self._device.motioneyedevice.motioneye_server.url
-            admin_username = (
-                self._device.motioneyedevice.motioneye_server.admin_username
+        if descriptor.kind in ["event", "analysis"]:
+            logger.info(
+                "{} of {} is read only".format(descriptor.service, self._device)
             )
-            admin_password = (
-                self._device.motioneyedevice.motioneye_server.admin_password
+            return None
+
+        self.poll_fast()
+        if descriptor.kind == "action":
+            # sent in the background, the variable goes back to False once done
+            self.loop.call_soon(self._action_queue.put, descriptor)
+            return 1
+
+        # Config
+        camera_config = self.get_camera_config()
+        if camera_config is None or descriptor.service not in camera_config:
+            logger.info(
+                "write {} failed for {}".format(descriptor.service, self._device)
             )
-            surveillance_username = (
-                self._device.motioneyedevice.motioneye_server.surveillance_username
-            )
-            surveillance_password = (
-                self._device.motioneyedevice.motioneye_server.surveillance_password
+            return None
+
+        updates = self.config_updates(descriptor, value)
+        if updates is None:
+            return None
+        self.loop.run(self.async_queue_config(updates))
+        # the next poll reads the variable again, showing the server value if
+        # the write fails
+        self.forget_read_values(updates)
+        # the value written, as a PyScada value
+        return descriptor.codec["reverse"][updates[descriptor.service]]
+
+    async def async_send_action(self, descriptor):
+        await get_server_poller(self._motioneye_server).async_wait_action_slot()
+        result = await async_do_action(
+            self._motioneye_device, descriptor.camera_id, str(descriptor.service)
+        )
+        return result is not None
+
+    def action_done(self, descriptors):
+        """
+        called on the loop when queued actions are sent or cancelled, the DAQ
+        process stores their reset on its next read
+        """
+        with self._actions_lock:
+            self._done_actions.update(d.variable.pk for d in descriptors)
+
+    def action_failed(self, descriptor):
+        """
+        called on the loop when a queued action could not be sent, its
+        variable stays True
+        """
+        logger.warning(
+            "Action {} failed for {}".format(descriptor.service, self._device)
+        )
+        metrics.inc(
+            "motioneye_action_failures_total",
+            action=str(descriptor.service),
+            server=str(self._motioneye_server),
+        )
+
+    def config_updates(self, descriptor, value):
+        """
+        return the camera config keys and values to send for a write
+        """
+        service = descriptor.service
+        codec = descriptor.codec
+        if codec["field"] == "boolean":
+            value = int(bool(value))
+        else:
+            value = int(value)
+        if value not in codec["forward"]:
+            logger.warning(
+                "Value {} not allowed for {} of {}".format(value, service, self._device)
             )
-            async with timeout(10) as tm:
-                client = MotionEyeClient(
-                    url,
-                    admin_username,
-                    admin_password,
-                    surveillance_username,
-                    surveillance_password,
-                )
-                try:
-                    if not client:
-                        self._not_accessible_reason = f"MotionEyeClient is {client}"
-                        return None
-                    resp = dict()
+            return None
 
-                    await client.async_client_login()
+        updates = dict()
+        updates[service] = codec["forward"][value]
 
-                    manifest = await client.async_get_manifest()
-                    server_config = await client.async_get_server_config()
-                    cameras = await client.async_get_cameras()
+        # for custom text overlay
+        if updates[service] == "custom-text":
+            try:
+                updates["custom_" + service] = str(
+                    descriptor.variable.variableproperty_set.get(name="text").value()
+                )
+            except VariableProperty.DoesNotExist:
+                logger.warning(
+                    "VariableProperty named text does not exist "
+                    "for custom text overlay var id {}".format(descriptor.variable.id)
+                )
+        return updates
 
-                    resp["manifest"] = manifest
-                    resp["server_config"] = server_config
-                    resp["cameras"] = cameras
+    def get_camera_config(self, max_age=None):
+        """
+        return the camera config of the last poll, read again if it is older
+        than max_age seconds
+        """
+        return self.loop.run(self.async_get_camera_config(max_age))
 
-                    return resp
+    async def async_get_camera_config(self, max_age=None):
+        if max_age is None:
+            max_age = self.camera_config_max_age
+        if self.camera_config is None or (
+            max_age is not None and time() - self.camera_config_time > max_age
+        ):
+            await self.async_get_cameras_config(max_age=max_age)
+        return self.camera_config
 
-                except asyncioCancelledError:
-                    self._not_accessible_reason = "Timeout"
-                finally:
-                    await client.async_client_close()
+    async def async_queue_config(self, updates):
+        """
+        mark the changed config keys as dirty, writes arriving within
+        config_write_delay are sent together
+        """
+        # server state once the request being sent is applied
+        current = dict(self.camera_config or {})
+        current.update(self._inflight_config)
+        for key, value in updates.items():
+            if key in current and str(current[key]) == str(value):
+                # back to the server value, nothing to send
+                self._dirty_config.pop(key, None)
+                continue
+            self._dirty_config[key] = value
+        if len(self._dirty_config) and self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self.async_flush_config())
+
+    async def async_flush_config(self):
+        """
+        send the dirty keys over the last known server state of the camera,
+        until no write is waiting
+        """
+        try:
+            while len(self._dirty_config):
+                await asyncio.sleep(self.config_write_delay)
+                dirty = self._dirty_config
+                self._dirty_config = dict()
+                self._inflight_config = dirty
+                if not await self.async_send_config(dirty):
+                    # read the server values again on the next poll
+                    self.forget_read_values(dirty)
+                self._inflight_config = dict()
+        finally:
+            self._inflight_config = dict()
+            self._flush_task = None
+
+    async def async_send_config(self, dirty):
+        for max_age in [None, 0]:
+            # on failure the cached config may be outdated, read it again and
+            # retry once
+            if max_age == 0:
+                metrics.inc(
+                    "motioneye_retries_total",
+                    reason="write",
+                    server=str(self._motioneye_server),
+                )
+            camera_config = await self.async_get_camera_config(max_age)
+            if camera_config is None:
+                continue
+            # motionEye needs the whole camera config in a set request
+            conf = dict(camera_config)
+            conf.update(dirty)
+            if await async_set_cameras_config(self._motioneye_device, conf):
+                self.camera_config = dict(camera_config, **dirty)
+                for key, value in dirty.items():
+                    self._written_config[key] = (value, time())
+                return True
+        logger.warning(
+            "Write of {} failed for {}".format(", ".join(dirty), self._device)
+        )
+        return False
 
-        except MotionEyeClientInvalidAuthError:
-            self._not_accessible_reason = (
-                f"Invalid motionEye authentication for {self._device.motioneyedevice}."
-            )
-        except MotionEyeClientConnectionError:
-            self._not_accessible_reason = (
-                f"MotionEye connection failure for {self._device.motioneyedevice}."
-            )
-        except MotionEyeClientRequestError:
-            self._not_accessible_reason = (
-                f"MotionEye request failure for {self._device.motioneyedevice}."
-            )
-        except MotionEyeClientURLParseError:
-            self._not_accessible_reason = (
-                f"Unable to parse the URL for {self._device.motioneyedevice}."
-            )
-        except MotionEyeClientPathError:
-            self._not_accessible_reason = (
-                f"Invalid path provided for {self._device.motioneyedevice}."
+    def forget_read_values(self, keys):
+        """
+        make the next poll read the variables of these config keys again
+        """
+        if self._read_config is not None:
+            for key in keys:
+                self._read_config.pop(key, None)
+        self._read_fingerprint = None
+
+    async def async_get_cameras_config(self, max_age=None):
+        # Refresh cameras configurations, the camera list is fetched once per
+        # cycle for all the devices of the same motionEye server. Also called
+        # on the loop while the DAQ thread reads the config, which is only
+        # replaced once complete, never changed in place.
+        camera_config = None
+        inst = None
+        if max_age is None:
+            max_age = self._device.polling_interval
+        try:
+            poller = get_server_poller(self._motioneye_server)
+            camera_config = await poller.async_get_camera(
+                self._motioneye_device.camera_id,
+                max_age=max_age,
             )
-        return None
+            self.camera_config_time = poller.last_query
+            inst = poller.response
+            camera_config = self.apply_written_config(camera_config)
+            if poller.not_accessible_reason is not None:
+                self._not_accessible_reason = poller.not_accessible_reason
+        except (TimeoutError, asyncioTimeoutError):
+            self._not_accessible_reason = "Timeout"
+        except Exception as e:
+            self._not_accessible_reason = e
+            # logger.warning(traceback.format_exc())
+        self.camera_config = camera_config
+        self.inst = inst
+
+    def apply_written_config(self, camera_config):
+        """
+        return a copy of a camera config keeping the written keys the server
+        had not applied when it was queried
+        """
+        if camera_config is None:
+            return None
+        camera_config = dict(camera_config)
+        for key, (value, written) in list(self._written_config.items()):
+            if self.camera_config_time > written:
+                # queried after the write, the server state is known
+                del self._written_config[key]
+            else:
+                camera_config[key] = value
+        return camera_config
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from . import PROTOCOL_ID
+from .models import MotionEyeDevice, MotionEyeVariable
+from .server import REQUEST_TIMEOUT
+from .signals import queue_reinit
+from pyscada.models import Device, Variable, Unit
+
+from django.db import transaction
+from django.utils.text import slugify
+
+import asyncio
+from asyncio import wait_for
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from motioneye_client.client import *
+
+    driver_ok = True
+except ImportError:
+    logger.error("Cannot import motioneye_client", exc_info=True)
+    driver_ok = False
+
+# services created for each discovered camera if none are chosen
+DEFAULT_SERVICES = [s for s, _ in MotionEyeVariable.service_other_choices]
+
+
+async def async_discover_cameras(server):
+    """
+    return the cameras configured in a motionEye server
+    """
+    async with MotionEyeClient(
+        server.url,
+        server.admin_username,
+        server.admin_password,
+        server.surveillance_username,
+        server.surveillance_password,
+    ) as client:
+        if client is None:
+            raise MotionEyeClientError(f"Cannot log in to {server}")
+        cameras = await wait_for(client.async_get_cameras(), timeout=REQUEST_TIMEOUT)
+    if type(cameras) != dict or "cameras" not in cameras:
+        return []
+    return cameras["cameras"]
+
+
+def discover_cameras(server):
+    """
+    read the camera list of a motionEye server once, outside of the DAQ
+    processes
+    """
+    return asyncio.run(async_discover_cameras(server))
+
+
+def unique_name(name, existing):
+    result = name
+    i = 1
+    while result in existing:
+        i += 1
+        result = "{}-{}".format(name, i)
+    existing.add(result)
+    return result
+
+
+def provision_cameras(server, cameras, services=None, polling_interval=5.0):
+    """
+    create the devices and variables of the cameras not yet in PyScada, in one
+    transaction and with a single DAQ daemon reinit, return the new devices
+    """
+    if services is None:
+        services = DEFAULT_SERVICES
+    known = set(
+        MotionEyeDevice.objects.filter(motioneye_server=server).values_list(
+            "camera_id", flat=True
+        )
+    )
+    cameras = [c for c in cameras if c["id"] not in known]
+    if not len(cameras):
+        return []
+
+    with transaction.atomic():
+        # bulk_create skips the save methods and post_save signals
+        device_names = set(Device.objects.values_list("short_name", flat=True))
+        devices = Device.objects.bulk_create(
+            [
+                Device(
+                    short_name=unique_name(
+                        camera.get("name") or "camera-{}".format(camera["id"]),
+                        device_names,
+                    ),
+                    description="motionEye camera {} of {}".format(
+                        camera["id"], server
+                    ),
+                    protocol_id=PROTOCOL_ID,
+                    polling_interval=polling_interval,
+                )
+                for camera in cameras
+            ]
+        )
+        if any(device.pk is None for device in devices):
+            # the database backend does not return the ids of bulk inserts
+            by_name = {
+                d.short_name: d
+                for d in Device.objects.filter(
+                    short_name__in=[d.short_name for d in devices]
+                )
+            }
+            devices = [by_name[d.short_name] for d in devices]
+
+        MotionEyeDevice.objects.bulk_create(
+            [
+                MotionEyeDevice(
+                    motioneye_device=device,
+                    motioneye_server=server,
+                    camera_id=camera["id"],
+                )
+                for device, camera in zip(devices, cameras)
+            ]
+        )
+
+        unit = Unit.objects.order_by("pk").first() or Unit.objects.create(unit="-")
+        variable_names = set(Variable.objects.values_list("name", flat=True))
+        variables = []
+        for device in devices:
+            for service in services:
+                variable = Variable(
+                    name=unique_name(
+                        slugify("{}-{}".format(device.short_name, service)),
+                        variable_names,
+                    ),
+                    description=dict(MotionEyeVariable.service_choices)[service],
+                    device=device,
+                    unit=unit,
+                )
+                variables.append(
+                    (
+                        MotionEyeVariable.configure_variable(variable, service),
+                        service,
+                    )
+                )
+        created = Variable.objects.bulk_create([v for v, _ in variables])
+        if any(v.pk is None for v in created):
+            by_name = {
+                v.name: v
+                for v in Variable.objects.filter(
+                    name__in=[v.name for v, _ in variables]
+                )
+            }
+            created = [by_name[v.name] for v, _ in variables]
+
+        MotionEyeVariable.objects.bulk_create(
+            [
+                MotionEyeVariable(motioneye_variable=variable, service=service)
+                for variable, (_, service) in zip(created, variables)
+            ]
+        )
+
+        # restart the MotionEye DAQ process once the objects are visible
+        queue_reinit([device.pk for device in devices])
+    logger.info(
+        "Added {} motionEye cameras of {} with {} variables".format(
+            len(devices), server, len(created)
+        )
+    )
+    return devices
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import asyncio
+import atexit
+import os
+from threading import Thread, Lock
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopThread:
+    """
+    An asyncio loop running in a background thread for the whole life of a DAQ
+    process. Sessions, tasks and timers created on it outlive a single call.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.pid = None
+        self._lock = Lock()
+        # coroutine functions awaited when the loop stops
+        self._on_stop = []
+
+    def on_stop(self, coro_func):
+        """
+        register a coroutine function to await before the loop stops
+        """
+        if coro_func not in self._on_stop:
+            self._on_stop.append(coro_func)
+
+    def is_running(self):
+        # a forked process does not inherit the loop thread
+        return (
+            self.loop is not None
+            and self.pid == os.getpid()
+            and self.thread is not None
+            and self.thread.is_alive()
+        )
+
+    def start(self):
+        with self._lock:
+            if not self.is_running():
+                self.loop = asyncio.new_event_loop()
+                self.pid = os.getpid()
+                self.thread = Thread(
+                    target=self._run_forever, name="motioneye-loop", daemon=True
+                )
+                self.thread.start()
+        return self.loop
+
+    def _run_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """
+        schedule a coroutine on the loop and return a concurrent.futures.Future
+        """
+        if not self.is_running():
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        run a coroutine on the loop and wait for its result
+        """
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args):
+        if not self.is_running():
+            self.start()
+        return self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self, timeout=5):
+        """
+        run the stop callbacks, close the pooled clients, cancel the pending
+        tasks and stop the loop
+        """
+        with self._lock:
+            if not self.is_running():
+                return False
+            from .pool import client_pool
+
+            for coro_func in self._on_stop + [client_pool.async_close_all]:
+                try:
+                    self.run(coro_func(), timeout=timeout)
+                except Exception as e:
+                    logger.debug(f"Error stopping {coro_func} : {e}")
+            self._on_stop = []
+            try:
+                self.run(self._async_cancel_tasks(), timeout=timeout)
+            except Exception as e:
+                logger.debug(f"Error cancelling motionEye tasks : {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+            if not self.thread.is_alive():
+                self.loop.close()
+            self.loop = None
+            self.thread = None
+            return True
+
+    async def _async_cancel_tasks(self):
+        current = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+event_loop = EventLoopThread()
+
+
+def get_event_loop():
+    """
+    return the loop of this DAQ process, started if needed
+    """
+    event_loop.start()
+    return event_loop
+
+
+atexit.register(event_loop.stop)
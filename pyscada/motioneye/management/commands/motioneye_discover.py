@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from pyscada.motioneye.discovery import (
+    DEFAULT_SERVICES,
+    discover_cameras,
+    provision_cameras,
+)
+from pyscada.motioneye.models import MotionEyeServer, MotionEyeVariable
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Add the cameras of a MotionEye server not yet in PyScada"
+
+    def add_arguments(self, parser):
+        parser.add_argument("server", help="id or url of the MotionEye server")
+        parser.add_argument(
+            "--services",
+            nargs="+",
+            default=DEFAULT_SERVICES,
+            choices=[s for s, _ in MotionEyeVariable.service_choices],
+            help="services to create a variable for",
+        )
+        parser.add_argument("--polling-interval", type=float, default=5.0)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="only list the cameras found"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["server"].isdigit():
+                server = MotionEyeServer.objects.get(pk=int(options["server"]))
+            else:
+                server = MotionEyeServer.objects.get(url=options["server"])
+        except MotionEyeServer.DoesNotExist:
+            raise CommandError(f"MotionEye server {options['server']} not found")
+
+        try:
+            cameras = discover_cameras(server)
+        except Exception as e:
+            raise CommandError(f"Cannot read the cameras of {server} : {e}")
+        for camera in cameras:
+            self.stdout.write(f"{camera['id']} : {camera.get('name', '')}")
+        if options["dry_run"]:
+            return
+
+        devices = provision_cameras(
+            server, cameras, options["services"], options["polling_interval"]
+        )
+        self.stdout.write(f"{len(devices)} camera(s) added")
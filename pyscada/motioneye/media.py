@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .server import get_server_poller
+
+from datetime import datetime, timedelta, timezone
+import posixpath
+import re
+
+import asyncio
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from motioneye_client.const import KEY_MEDIA_LIST, KEY_PATH
+
+    driver_ok = True
+except ImportError:
+    logger.error("Cannot import motioneye_client", exc_info=True)
+    driver_ok = False
+
+# MotionEyeMedia kind -> MotionEyeClient method listing them
+MEDIA_LIST_METHODS = {
+    "movie": "async_get_movies",
+    "picture": "async_get_images",
+}
+
+# MotionEyeMedia kind -> camera config key of the file name pattern
+MEDIA_FILE_NAME_KEYS = {
+    "movie": "movie_file_name",
+    "picture": "image_file_name",
+}
+
+# max date folders listed one by one, older indexes list the whole camera
+MAX_PREFIX_DAYS = 7
+# seconds before a listing from which the next one starts, the files modified
+# meanwhile may still be written
+RELIST_MARGIN = 60
+
+SIZE_UNITS = {"B": 1, "kB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_size(size_str):
+    """
+    return the bytes of a motionEye size string, ex: '1.5 MB'
+    """
+    match = re.match(r"^\s*([0-9.]+)\s*([kMG]?B)\s*$", str(size_str or ""))
+    if match is None:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def media_prefixes(file_name, since):
+    """
+    return the folders holding the media stored since a datetime, None to list
+    all of them
+    """
+    folder = posixpath.dirname(file_name or "")
+    if not folder or since is None:
+        return None
+    if "%" not in folder:
+        return [folder]
+    if re.search(r"%[^Ymd]", folder):
+        # not a date folder
+        return None
+    # the folders are named in the local time of the server
+    first = (since - timedelta(days=1)).date()
+    last = (datetime.now(timezone.utc) + timedelta(days=1)).date()
+    if (last - first).days >= MAX_PREFIX_DAYS:
+        return None
+    return [
+        (first + timedelta(days=i)).strftime(folder)
+        for i in range((last - first).days + 1)
+    ]
+
+
+def media_entries(response, since=None):
+    """
+    return (path, timestamp, size) of the listed media modified since a datetime
+    """
+    entries = []
+    if type(response) != dict:
+        return entries
+    for entry in response.get(KEY_MEDIA_LIST) or []:
+        try:
+            timestamp = datetime.fromtimestamp(float(entry["timestamp"]), timezone.utc)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if since is not None and timestamp < since:
+            continue
+        entries.append((entry[KEY_PATH], timestamp, parse_size(entry.get("sizeStr"))))
+    return entries
+
+
+async def async_list_media(server, camera_id, kind, camera_config, since=None):
+    """
+    list the movies or pictures of a camera modified since a datetime, only in
+    the date folders from this day when the camera stores them by date, the
+    folders concurrently
+    """
+    poller = get_server_poller(server)
+    prefixes = media_prefixes(camera_config.get(MEDIA_FILE_NAME_KEYS[kind]), since)
+    responses = await asyncio.gather(
+        *[
+            poller.async_call(
+                MEDIA_LIST_METHODS[kind], camera_id, prefix, camera=camera_id
+            )
+            for prefix in prefixes or [None]
+        ]
+    )
+    entries = []
+    for response in responses:
+        entries += media_entries(response, since)
+    return entries
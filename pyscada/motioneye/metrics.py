@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# value of the motioneye_circuit_state gauge
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        """
+        return (upper bound, number of values lower or equal) for each bucket
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not len(labels):
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            )
+            for k, v in labels
+        )
+        + "}"
+    )
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms of the motionEye requests of this
+    process, keyed by name and labels
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # name -> {labels: value}
+            self.counters = dict()
+            self.gauges = dict()
+            self.histograms = dict()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self.counters.setdefault(name, dict())
+            key = _labels(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges.setdefault(name, dict())[_labels(labels)] = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self.histograms.setdefault(name, dict())
+            key = _labels(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, phase, **labels):
+        """
+        observe the duration of a request phase and count its errors by
+        exception class
+        """
+        start = perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.inc(
+                "motioneye_errors_total",
+                phase=phase,
+                exception=e.__class__.__name__,
+                **labels,
+            )
+            raise
+        finally:
+            self.observe(
+                "motioneye_request_duration_seconds",
+                perf_counter() - start,
+                phase=phase,
+                **labels,
+            )
+
+    def snapshot(self):
+        """
+        return a copy of all the metrics :
+        {"counters": {name: {labels: value}}, "gauges": ..., "histograms":
+        {name: {labels: {"count", "sum", "buckets"}}}}, labels being a tuple of
+        (name, value) pairs
+        """
+        with self._lock:
+            return {
+                "counters": {n: dict(s) for n, s in self.counters.items()},
+                "gauges": {n: dict(s) for n, s in self.gauges.items()},
+                "histograms": {
+                    n: {
+                        k: {"count": h.count, "sum": h.sum, "buckets": h.cumulative()}
+                        for k, h in s.items()
+                    }
+                    for n, s in self.histograms.items()
+                },
+            }
+
+    def render(self):
+        """
+        return the metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for kind in ["counters", "gauges"]:
+            for name, series in sorted(snapshot[kind].items()):
+                lines.append(
+                    "# TYPE {} {}".format(
+                        name, "counter" if kind == "counters" else "gauge"
+                    )
+                )
+                for labels, value in sorted(series.items()):
+                    lines.append(
+                        "{}{} {}".format(
+                            name, _format_labels(labels), _format_value(value)
+                        )
+                    )
+        for name, series in sorted(snapshot["histograms"].items()):
+            lines.append("# TYPE {} histogram".format(name))
+            for labels, h in sorted(series.items()):
+                for bound, count in h["buckets"]:
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            name,
+                            _format_labels(labels, [("le", str(bound))]),
+                            count,
+                        )
+                    )
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        name, _format_labels(labels, [("le", "+Inf")]), h["count"]
+                    )
+                )
+                lines.append(
+                    "{}_sum{} {}".format(name, _format_labels(labels), h["sum"])
+                )
+                lines.append(
+                    "{}_count{} {}".format(name, _format_labels(labels), h["count"])
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _add_label(line, name, value):
+    """
+    add a label to a sample line of the Prometheus text format
+    """
+    label = _format_labels([(name, value)])[1:-1]
+    series, sample = line.rsplit(" ", 1)
+    if "{" in series:
+        series = series.replace("{", "{" + label + ",", 1)
+    else:
+        series += "{" + label + "}"
+    return series + " " + sample
+
+
+def merge_rendered(documents):
+    """
+    merge the metrics rendered by several processes, given as (process label,
+    text) pairs, into one text with a process label on each sample
+    """
+    # name -> (TYPE line, sample lines)
+    families = dict()
+    for process, text in documents:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# TYPE "):
+                name = line.split()[2]
+                families.setdefault(name, (line, []))
+            elif line and not line.startswith("#") and name is not None:
+                families[name][1].append(_add_label(line, "process", process))
+    lines = []
+    for name, (type_line, samples) in sorted(families.items()):
+        lines.append(type_line)
+        lines += samples
+    return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0007_alter_motioneyevariable_service"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motioneyeserver",
+            name="static_config_ttl",
+            field=models.PositiveIntegerField(
+                default=3600,
+                help_text="Seconds the server manifest and main config are cached, "
+                "0 to read them on every poll",
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0009_motioneyeserver_webhook_url"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motioneyedevice",
+            name="max_poll_interval",
+            field=models.PositiveIntegerField(
+                default=300,
+                help_text="Max seconds between two polls of a camera whose config does not change, 0 to always poll at the min interval",
+            ),
+        ),
+        migrations.AddField(
+            model_name="motioneyedevice",
+            name="min_poll_interval",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Seconds between two polls of the camera after a change, 0 to use the device polling interval",
+            ),
+        ),
+    ]
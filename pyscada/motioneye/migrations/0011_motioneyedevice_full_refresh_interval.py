@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0010_motioneyedevice_poll_interval"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motioneyedevice",
+            name="full_refresh_interval",
+            field=models.PositiveIntegerField(
+                default=3600,
+                help_text="Seconds between two reads of all the variables, the other polls only read the variables whose value changed. 0 to always read all of them",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# the motionEye values dictionary when this migration was written, the later
+# items are added by get_services_dictionary_id
+SERVICES_DICTIONARY_NAME = "MotionEye_non_boolean_services"
+SERVICES_DICTIONARY_ITEMS = [
+    ("Camera name", "3"),
+    ("Continuous", "7"),
+    ("Custom text", "4"),
+    ("Disabled", "5"),
+    ("False", "0"),
+    ("Motion triggered", "6"),
+    ("Timestamp", "2"),
+    ("True", "1"),
+]
+
+
+def forwards_func(apps, schema_editor):
+    Dictionary = apps.get_model("pyscada", "Dictionary")
+    DictionaryItem = apps.get_model("pyscada", "DictionaryItem")
+    db_alias = schema_editor.connection.alias
+    d, created = Dictionary.objects.using(db_alias).get_or_create(
+        name=SERVICES_DICTIONARY_NAME
+    )
+    existing = set(
+        DictionaryItem.objects.using(db_alias)
+        .filter(dictionary=d)
+        .values_list("label", "value")
+    )
+    DictionaryItem.objects.using(db_alias).bulk_create(
+        [
+            DictionaryItem(label=label, value=value, dictionary=d)
+            for label, value in SERVICES_DICTIONARY_ITEMS
+            if (label, value) not in existing
+        ]
+    )
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0011_motioneyedevice_full_refresh_interval"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0012_sync_services_dictionary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motioneyedevice",
+            name="snapshot_buffer_size",
+            field=models.PositiveSmallIntegerField(
+                default=10, help_text="Number of snapshots kept in memory"
+            ),
+        ),
+        migrations.AddField(
+            model_name="motioneyedevice",
+            name="snapshot_period",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Seconds between two snapshots fetched in the background, 0 to only fetch them when viewed",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="motioneyeserver",
+            name="webhook_url",
+            field=models.URLField(
+                blank=True,
+                default="",
+                help_text="URL of the PyScada worker called by the motionEye web hooks and serving the snapshots, ex: http://192.168.1.10:8321/. Leave empty to disable the events and the snapshots.",
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0014_analysis"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motioneyedevice",
+            name="media_index_interval",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Seconds between two listings of the new movies and pictures of the camera, 0 to disable",
+            ),
+        ),
+        migrations.CreateModel(
+            name="MotionEyeMedia",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("movie", "Movie"), ("picture", "Picture")],
+                        max_length=7,
+                    ),
+                ),
+                (
+                    "path",
+                    models.CharField(
+                        help_text="Path in the media folder of the camera",
+                        max_length=255,
+                    ),
+                ),
+                (
+                    "timestamp",
+                    models.DateTimeField(help_text="Last modification of the file"),
+                ),
+                (
+                    "size",
+                    models.PositiveBigIntegerField(
+                        blank=True,
+                        help_text="Bytes, rounded in the motionEye listing",
+                        null=True,
+                    ),
+                ),
+                (
+                    "duration",
+                    models.FloatField(blank=True, help_text="Seconds", null=True),
+                ),
+                (
+                    "motioneye_device",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="motioneye.motioneyedevice",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "MotionEye media",
+                "indexes": [
+                    models.Index(
+                        fields=["motioneye_device", "timestamp"],
+                        name="motioneye_m_motione_18d9b1_idx",
+                    )
+                ],
+                "unique_together": {("motioneye_device", "kind", "path")},
+            },
+        ),
+    ]
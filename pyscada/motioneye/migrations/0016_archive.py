@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0015_media"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motioneyedevice",
+            name="archive_movies",
+            field=models.BooleanField(
+                default=False,
+                help_text="Download the indexed movies to the archive folder of the server",
+            ),
+        ),
+        migrations.AddField(
+            model_name="motioneyemedia",
+            name="archived",
+            field=models.DateTimeField(
+                blank=True, help_text="Download to the archive folder", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="motioneyemedia",
+            name="sha256",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="motioneyeserver",
+            name="archive_dir",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Local folder where the movies of the cameras are downloaded, empty to disable",
+                max_length=255,
+            ),
+        ),
+        migrations.AddField(
+            model_name="motioneyeserver",
+            name="max_downloads",
+            field=models.PositiveSmallIntegerField(
+                default=1, help_text="Max number of movies downloaded at the same time"
+            ),
+        ),
+    ]
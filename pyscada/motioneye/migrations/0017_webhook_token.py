@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:26
+
+from django.db import migrations, models
+import pyscada.motioneye.models
+
+
+def forwards_func(apps, schema_editor):
+    # the default is computed once for the existing rows, one token per server
+    MotionEyeServer = apps.get_model("motioneye", "MotionEyeServer")
+    db_alias = schema_editor.connection.alias
+    for server in MotionEyeServer.objects.using(db_alias).all():
+        server.webhook_token = pyscada.motioneye.models.new_webhook_token()
+        server.save(update_fields=["webhook_token"])
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("motioneye", "0016_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="motioneyeserver",
+            name="webhook_token",
+            field=models.CharField(
+                blank=True,
+                default=pyscada.motioneye.models.new_webhook_token,
+                help_text="Secret expected in the token parameter of the web hook, snapshot and stream URLs of the cameras. Leave empty to serve them without token.",
+                max_length=64,
+            ),
+        ),
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
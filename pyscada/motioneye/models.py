@@ -4,24 +4,60 @@ from __future__ import unicode_literals
 from pyscada.models import Device
 from pyscada.models import Variable
 from pyscada.models import VariableProperty
-from pyscada.models import Dictionary
+from pyscada.models import Dictionary, DictionaryItem
 from . import PROTOCOL_ID
 
 from django.db import models
 from django.core.exceptions import ValidationError
 
+import hashlib
+import json
 import re
+import secrets
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def new_webhook_token():
+    return secrets.token_urlsafe(24)
+
+
 class MotionEyeServer(models.Model):
     url = models.URLField(blank=False, help_text="MotionEye server URL", unique=True)
     admin_username = models.CharField(default="admin", max_length=50)
     admin_password = models.CharField(default="", max_length=50, blank=True)
     surveillance_username = models.CharField(default="user", max_length=50)
     surveillance_password = models.CharField(default="", max_length=50, blank=True)
+    static_config_ttl = models.PositiveIntegerField(
+        default=3600,
+        help_text="Seconds the server manifest and main config are cached, "
+        "0 to read them on every poll",
+    )
+    webhook_url = models.URLField(
+        default="",
+        blank=True,
+        help_text="URL of the PyScada worker called by the motionEye web hooks and "
+        "serving the snapshots, ex: http://192.168.1.10:8321/. Leave empty to "
+        "disable the events and the snapshots.",
+    )
+    webhook_token = models.CharField(
+        default=new_webhook_token,
+        blank=True,
+        max_length=64,
+        help_text="Secret expected in the token parameter of the web hook, snapshot "
+        "and stream URLs of the cameras. Leave empty to serve them without token.",
+    )
+    archive_dir = models.CharField(
+        default="",
+        blank=True,
+        max_length=255,
+        help_text="Local folder where the movies of the cameras are downloaded, "
+        "empty to disable",
+    )
+    max_downloads = models.PositiveSmallIntegerField(
+        default=1, help_text="Max number of movies downloaded at the same time"
+    )
 
     def __str__(self):
         return str(self.url)
@@ -37,6 +73,43 @@ class MotionEyeDevice(models.Model):
     camera_id = models.PositiveSmallIntegerField(
         default=0, help_text="Camera ID in the MotionEye server"
     )
+    min_poll_interval = models.PositiveIntegerField(
+        default=0,
+        help_text="Seconds between two polls of the camera after a change, "
+        "0 to use the device polling interval",
+    )
+    max_poll_interval = models.PositiveIntegerField(
+        default=300,
+        help_text="Max seconds between two polls of a camera whose config does not "
+        "change, 0 to always poll at the min interval",
+    )
+    full_refresh_interval = models.PositiveIntegerField(
+        default=3600,
+        help_text="Seconds between two reads of all the variables, the other polls "
+        "only read the variables whose value changed. 0 to always read all of them",
+    )
+    snapshot_period = models.PositiveIntegerField(
+        default=0,
+        help_text="Seconds between two snapshots fetched in the background, "
+        "0 to only fetch them when viewed",
+    )
+    snapshot_buffer_size = models.PositiveSmallIntegerField(
+        default=10, help_text="Number of snapshots kept in memory"
+    )
+    analysis_period = models.PositiveIntegerField(
+        default=0,
+        help_text="Seconds between two snapshots analysed for the activity and "
+        "brightness services, 0 to disable. Needs numpy and Pillow",
+    )
+    media_index_interval = models.PositiveIntegerField(
+        default=0,
+        help_text="Seconds between two listings of the new movies and pictures of "
+        "the camera, 0 to disable",
+    )
+    archive_movies = models.BooleanField(
+        default=False,
+        help_text="Download the indexed movies to the archive folder of the server",
+    )
 
     protocol_id = PROTOCOL_ID
 
@@ -50,6 +123,50 @@ class MotionEyeDevice(models.Model):
         return self.motioneye_device.short_name
 
 
+class MotionEyeMediaQuerySet(models.QuerySet):
+    def between(self, start, end):
+        """
+        media modified from start included to end excluded
+        """
+        return self.filter(timestamp__gte=start, timestamp__lt=end)
+
+
+class MotionEyeMedia(models.Model):
+    """
+    movie or picture stored by a motionEye camera, indexed by the DAQ process
+    """
+
+    kind_choices = (
+        ("movie", "Movie"),
+        ("picture", "Picture"),
+    )
+
+    motioneye_device = models.ForeignKey(MotionEyeDevice, on_delete=models.CASCADE)
+    kind = models.CharField(choices=kind_choices, max_length=7)
+    path = models.CharField(
+        max_length=255, help_text="Path in the media folder of the camera"
+    )
+    timestamp = models.DateTimeField(help_text="Last modification of the file")
+    size = models.PositiveBigIntegerField(
+        null=True, blank=True, help_text="Bytes, rounded in the motionEye listing"
+    )
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds")
+    archived = models.DateTimeField(
+        null=True, blank=True, help_text="Download to the archive folder"
+    )
+    sha256 = models.CharField(default="", blank=True, max_length=64)
+
+    objects = MotionEyeMediaQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("motioneye_device", "kind", "path")
+        indexes = [models.Index(fields=["motioneye_device", "timestamp"])]
+        verbose_name_plural = "MotionEye media"
+
+    def __str__(self):
+        return "{} {}".format(self.motioneye_device, self.path)
+
+
 class MotionEyeVariable(models.Model):
     motioneye_variable = models.OneToOneField(
         Variable, null=True, blank=True, on_delete=models.CASCADE
@@ -92,7 +209,25 @@ class MotionEyeVariable(models.Model):
         ("recording_mode", "Recording mode"),  # 'motion-triggered', 'continuous'
     )
 
-    service_choices = service_actions_choices + service_other_choices
+    service_event_choices = (
+        # pushed by the motionEye web hooks
+        ("motion_detected", "Motion detected"),
+        ("picture_stored", "Picture stored"),
+        ("movie_stored", "Movie stored"),
+    )
+
+    service_analysis_choices = (
+        # computed from the snapshots when the device analysis period is set
+        ("activity", "Activity (% of pixels changed)"),
+        ("brightness", "Brightness (mean luma 0-255)"),
+    )
+
+    service_choices = (
+        service_actions_choices
+        + service_other_choices
+        + service_event_choices
+        + service_analysis_choices
+    )
 
     service = models.CharField(
         default="snapshot",
@@ -122,33 +257,37 @@ class MotionEyeVariable(models.Model):
     def __str__(self):
         return self.id.__str__() + "-" + self.motioneye_variable.short_name
 
+    @classmethod
+    def configure_variable(cls, variable, service):
+        """
+        set the value class, writeable flag and dictionary of a variable for a
+        service, without saving it
+        """
+        if service in dict(cls.service_analysis_choices):
+            variable.value_class = "FLOAT32"
+            variable.writeable = False
+            variable.dictionary_id = None
+            return variable
+        variable.value_class = "BOOLEAN"
+        variable.writeable = service not in dict(cls.service_event_choices)
+        if SERVICE_CODECS[service]["field"] != "boolean":
+            variable.value_class = "INT16"
+        variable.dictionary_id = get_services_dictionary_id()
+        return variable
+
     def save(self, *args, **kwargs):
-        self.motioneye_variable.value_class = "BOOLEAN"
-        self.motioneye_variable.writeable = True
-
-        d = None
-        for field in self.service_not_boolean:
-            if re.compile(field, re.IGNORECASE).match(self.service):
-                # if field in self.service:
-                d, created = Dictionary.objects.get_or_create(
-                    name="MotionEye_non_boolean_services"
-                )
-                for i in self.service_not_boolean[field]:
-                    d.append(self.service_not_boolean[field][i][1], i, True)
-
-        if d is not None:
-            self.motioneye_variable.value_class = "INT16"
+        self.configure_variable(self.motioneye_variable, self.service)
+        super().save(*args, **kwargs)
+        if self.motioneye_variable.pk is None:
+            self.motioneye_variable.save()
         else:
-            d, created = Dictionary.objects.get_or_create(
-                name="MotionEye_non_boolean_services"
+            # update without a second post_save of the variable, the DAQ
+            # process is reinitialised once by the MotionEyeVariable post_save
+            Variable.objects.filter(pk=self.motioneye_variable.pk).update(
+                value_class=self.motioneye_variable.value_class,
+                writeable=self.motioneye_variable.writeable,
+                dictionary_id=self.motioneye_variable.dictionary_id,
             )
-            field = "boolean"
-            for i in self.service_not_boolean[field]:
-                d.append(self.service_not_boolean[field][i][1], i, True)
-
-        self.motioneye_variable.dictionary = d
-        super().save(*args, **kwargs)
-        self.motioneye_variable.save()
 
         # Create variable property for custom text overlay
         if "text_overlay" in self.service:
@@ -169,6 +308,84 @@ class MotionEyeVariable(models.Model):
         super().validate_unique(exclude=exclude)
 
 
+def build_service_codecs():
+    """
+    resolve once the value mapping of each service : forward from the PyScada
+    value to the motionEye string, reverse from the motionEye string to the value
+    """
+    codecs = dict()
+    for service, service_label in MotionEyeVariable.service_choices:
+        field = "boolean"
+        for f in MotionEyeVariable.service_not_boolean:
+            if f != "boolean" and re.compile(f, re.IGNORECASE).match(service):
+                field = f
+        mapping = MotionEyeVariable.service_not_boolean[field]
+        codecs[service] = dict(
+            field=field,
+            forward={i: mapping[i][0] for i in mapping},
+            reverse={mapping[i][0]: i for i in mapping},
+            labels={i: mapping[i][1] for i in mapping},
+        )
+    return codecs
+
+
+SERVICE_CODECS = build_service_codecs()
+
+
+SERVICES_DICTIONARY_NAME = "MotionEye_non_boolean_services"
+
+
+def services_dictionary_items():
+    """
+    (label, value) of the items of the motionEye values dictionary, as stored
+    """
+    items = set()
+    for codec in SERVICE_CODECS.values():
+        items.update((label, str(i)) for i, label in codec["labels"].items())
+    return sorted(items)
+
+
+# changes with the value mapping of the services, the dictionary is synced again
+SERVICES_DICTIONARY_VERSION = hashlib.sha1(
+    json.dumps(services_dictionary_items()).encode()
+).hexdigest()
+
+
+def sync_services_dictionary():
+    """
+    create the motionEye values dictionary and its missing items, return its id
+    """
+    d, created = Dictionary.objects.get_or_create(name=SERVICES_DICTIONARY_NAME)
+    existing = set(
+        DictionaryItem.objects.filter(dictionary=d).values_list("label", "value")
+    )
+    DictionaryItem.objects.bulk_create(
+        [
+            DictionaryItem(label=label, value=value, dictionary=d)
+            for label, value in services_dictionary_items()
+            if (label, value) not in existing
+        ]
+    )
+    return d.pk
+
+
+# (version, id) of the dictionary synced by this process
+_services_dictionary = (None, None)
+
+
+def get_services_dictionary_id():
+    """
+    return the id of the motionEye values dictionary, synced once per process
+    and mapping version
+    """
+    global _services_dictionary
+    version, dictionary_id = _services_dictionary
+    if version != SERVICES_DICTIONARY_VERSION:
+        dictionary_id = sync_services_dictionary()
+        _services_dictionary = (SERVICES_DICTIONARY_VERSION, dictionary_id)
+    return dictionary_id
+
+
 class ExtendedMotionEyeDevice(Device):
     class Meta:
         proxy = True
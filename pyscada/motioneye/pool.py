@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import asyncio
+
+from .metrics import metrics
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+    from motioneye_client.client import *
+
+    driver_ok = True
+except ImportError:
+    logger.error("Cannot import motioneye_client", exc_info=True)
+    driver_ok = False
+
+# seconds an idle connection to a motionEye server is kept open
+KEEPALIVE_TIMEOUT = 60
+
+
+def server_key(server):
+    """
+    pooled clients are shared by all the MotionEyeServer having the same url and
+    credentials
+    """
+    return (
+        server.url,
+        server.admin_username,
+        server.admin_password,
+        server.surveillance_username,
+        server.surveillance_password,
+    )
+
+
+class PooledClient:
+    """
+    A MotionEyeClient with its own keep-alive session, logged in on first use
+    """
+
+    def __init__(self, server):
+        # server label of the metrics
+        self.label = str(server)
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_response_chunk_received.append(self._on_chunk_received)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(keepalive_timeout=KEEPALIVE_TIMEOUT),
+            trace_configs=[trace_config],
+        )
+        self.client = MotionEyeClient(
+            server.url,
+            server.admin_username,
+            server.admin_password,
+            server.surveillance_username,
+            server.surveillance_password,
+            session=self.session,
+        )
+        self.logged_in = False
+        self._login_lock = None
+
+    async def _on_chunk_received(self, session, context, params):
+        metrics.inc(
+            "motioneye_received_bytes_total", len(params.chunk), server=self.label
+        )
+
+    async def async_login(self):
+        await self.client.async_client_login()
+        self.logged_in = True
+
+    async def async_ensure_login(self):
+        """
+        log in once even if several requests are issued concurrently
+        """
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if not self.logged_in:
+                await self.async_login()
+
+    async def async_call(self, method, *args, **kwargs):
+        """
+        call a MotionEyeClient method, logging in lazily and once again if the
+        server refuses the current authentication
+        """
+        await self.async_ensure_login()
+        try:
+            return await getattr(self.client, method)(*args, **kwargs)
+        except MotionEyeClientInvalidAuthError:
+            metrics.inc("motioneye_retries_total", reason="auth", server=self.label)
+            self.logged_in = False
+            await self.async_ensure_login()
+            return await getattr(self.client, method)(*args, **kwargs)
+
+    async def async_close(self):
+        self.logged_in = False
+        await self.session.close()
+
+
+class ClientPool:
+    """
+    Long-lived MotionEyeClients keyed by server url and credentials
+    """
+
+    def __init__(self):
+        self._clients = {}
+
+    def get(self, server):
+        key = server_key(server)
+        if key not in self._clients:
+            self._clients[key] = PooledClient(server)
+        return self._clients[key]
+
+    async def async_call(self, server, method, *args, **kwargs):
+        return await self.get(server).async_call(method, *args, **kwargs)
+
+    async def async_discard(self, server):
+        """
+        close the client of a server, the next call will open a new one
+        """
+        client = self._clients.pop(server_key(server), None)
+        if client is not None:
+            await client.async_close()
+
+    async def async_close_all(self):
+        clients = list(self._clients.values())
+        self._clients = {}
+        for client in clients:
+            try:
+                await client.async_close()
+            except Exception as e:
+                logger.debug(f"Error closing motionEye client : {e}")
+
+
+client_pool = ClientPool()
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from time import time
+from typing import Any
+import random
+
+import asyncio
+from asyncio import wait_for
+
+from .loop import get_event_loop
+from .pool import client_pool, server_key
+from .metrics import metrics, CIRCUIT_STATES
+
+try:
+    from asyncio.exceptions import TimeoutError as asyncioTimeoutError
+except ModuleNotFoundError:
+    # for python version < 3.8
+    from asyncio import TimeoutError as asyncioTimeoutError
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+    from motioneye_client.client import *
+
+    driver_ok = True
+except ImportError:
+    logger.error("Cannot import motioneye_client", exc_info=True)
+    driver_ok = False
+
+# seconds allowed to each request of a poll
+REQUEST_TIMEOUT = 5
+
+
+def is_connection_failure(exc):
+    """
+    return True if the server did not answer, as opposed to an answer with an
+    error
+    """
+    if isinstance(exc, (TimeoutError, asyncioTimeoutError)):
+        return True
+    if not driver_ok:
+        return False
+    if isinstance(exc, MotionEyeClientConnectionError):
+        return True
+    # connection reset or closed by the server during the request
+    return isinstance(exc, MotionEyeClientRequestError) and isinstance(
+        exc.__cause__, aiohttp.ClientError
+    )
+
+
+class CircuitOpenError(Exception):
+    """
+    raised instead of sending a request to an unreachable server
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a server after consecutive connection failures,
+    then let a single request probe it on an exponential schedule
+    """
+
+    # consecutive failures opening the circuit
+    failure_threshold = 3
+    # seconds before the first probe, doubled after each failed probe
+    base_delay = 5
+    max_delay = 300
+    # the probe delay varies randomly by +/- this ratio
+    jitter = 0.2
+    # seconds after which a probe without result is considered lost
+    probe_timeout = 30
+
+    def __init__(self, label=""):
+        # server label of the metrics
+        self.label = label
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self.next_probe = 0
+        metrics.set("motioneye_circuit_state", CIRCUIT_STATES["closed"], server=label)
+
+    def set_state(self, state):
+        if state == "open" and self.state != "open":
+            metrics.inc("motioneye_circuit_opened_total", server=self.label)
+        self.state = state
+        metrics.set("motioneye_circuit_state", CIRCUIT_STATES[state], server=self.label)
+
+    def allow(self):
+        """
+        return True if a request may be sent now
+        """
+        if self.state == "closed":
+            return True
+        if time() >= self.next_probe:
+            # the caller is the probe, the others wait for its result or for
+            # probe_timeout if it never comes
+            self.set_state("half_open")
+            self.next_probe = time() + self.probe_timeout
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            self.set_state("closed")
+        self.failures = 0
+        self.opened = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            delay = min(self.max_delay, self.base_delay * 2 ** min(self.opened, 16))
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+            self.next_probe = time() + delay
+            self.opened += 1
+            self.set_state("open")
+
+    def reason(self, server):
+        return "MotionEye server {} unreachable, next try in {:.0f}s.".format(
+            server, max(0, self.next_probe - time())
+        )
+
+
+class ServerPoller:
+    """
+    Query a motionEye server once per cycle and share the camera list
+    between all the devices using this server
+    """
+
+    # min seconds between two actions sent to the server
+    action_interval = 0.2
+
+    def __init__(self, server):
+        self.server = server
+        self.response = None
+        self.last_query = 0
+        self.not_accessible_reason = None
+        # near-static documents : name -> (value, time of the query)
+        self.static_cache = dict()
+        self.breaker = CircuitBreaker(str(server))
+        self.next_action_time = 0
+        # running query of the camera list
+        self.refresh_task = None
+
+    def invalidate(self):
+        """
+        forget the cached camera list, manifest and server config
+        """
+        self.static_cache = dict()
+        self.response = None
+        self.last_query = 0
+
+    def get_static(self, name):
+        """
+        return a cached manifest or server config if younger than the server TTL
+        """
+        if name not in self.static_cache:
+            return None
+        value, query_time = self.static_cache[name]
+        if time() - query_time >= getattr(self.server, "static_config_ttl", 0):
+            return None
+        return value
+
+    async def async_get_camera(self, camera_id, max_age=0):
+        """
+        return the config of a camera, refreshing the camera list only if the
+        last query is older than max_age seconds, a failed query is shared too
+        """
+        if self.refresh_task is not None or time() - self.last_query >= max_age:
+            await self.async_refresh()
+        return self.get_camera(camera_id)
+
+    def get_camera(self, camera_id):
+        if (
+            type(self.response) == dict
+            and "cameras" in self.response
+            and type(self.response["cameras"]) == dict
+            and "cameras" in self.response["cameras"]
+        ):
+            for camera in self.response["cameras"]["cameras"]:
+                if camera["id"] == camera_id:
+                    return camera
+        return None
+
+    async def async_wait_action_slot(self):
+        """
+        wait until an action may be sent to the server, at most one every
+        action_interval seconds
+        """
+        now = time()
+        slot = max(now, self.next_action_time)
+        self.next_action_time = slot + self.action_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def async_call(self, method, *args, timeout=REQUEST_TIMEOUT, camera=None):
+        """
+        call a MotionEyeClient method through the circuit breaker of the server
+        """
+        labels = dict(server=self.breaker.label)
+        if camera is not None:
+            labels["camera"] = camera
+        if not self.breaker.allow():
+            metrics.inc("motioneye_short_circuits_total", **labels)
+            raise CircuitOpenError(self.breaker.reason(self.server))
+        try:
+            with metrics.timer(method[len("async_") :], **labels):
+                result = await wait_for(
+                    client_pool.async_call(self.server, method, *args), timeout=timeout
+                )
+        except Exception as e:
+            if is_connection_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def async_refresh(self):
+        """
+        query the camera list, the callers arriving during a query wait for
+        its result instead of sending another one
+        """
+        if self.refresh_task is None:
+            self.refresh_task = asyncio.ensure_future(self._async_refresh())
+        # a cancelled caller does not cancel the query of the others
+        return await asyncio.shield(self.refresh_task)
+
+    async def _async_refresh(self):
+        started = time()
+        response = None
+        reason = None
+        try:
+            if not self.breaker.allow():
+                metrics.inc("motioneye_short_circuits_total", server=self.breaker.label)
+                reason = self.breaker.reason(self.server)
+            else:
+                with metrics.timer("poll", server=self.breaker.label):
+                    response, reason = await self.async_query_motioneye_server()
+        except (TimeoutError, asyncioTimeoutError):
+            reason = "Timeout"
+        except Exception as e:
+            reason = e
+        finally:
+            self.refresh_task = None
+        # replaced together once the query is over, a failure is shared until
+        # the next query too
+        self.response = response
+        self.last_query = started
+        self.not_accessible_reason = reason
+        return response
+
+    async def async_query_motioneye_server(self):
+        """
+        return the response of the server and None, or None and the reason of
+        the failure
+        """
+        try:
+            resp = await self._async_query_motioneye_server()
+            self.breaker.record_success()
+            return resp, None
+        except Exception as e:
+            if is_connection_failure(e):
+                self.breaker.record_failure()
+            else:
+                # the server answered
+                self.breaker.record_success()
+            try:
+                raise
+            except (TimeoutError, asyncioTimeoutError):
+                return None, "Timeout"
+            except MotionEyeClientInvalidAuthError:
+                return None, f"Invalid motionEye authentication for {self.server}."
+            except MotionEyeClientConnectionError:
+                return None, f"MotionEye connection failure for {self.server}."
+            except MotionEyeClientRequestError:
+                return None, f"MotionEye request failure for {self.server}."
+            except MotionEyeClientURLParseError:
+                return None, f"Unable to parse the URL for {self.server}."
+            except MotionEyeClientPathError:
+                return None, f"Invalid path provided for {self.server}."
+
+    async def _async_query_motioneye_server(self) -> dict[str, Any]:
+        client = client_pool.get(self.server)
+        with metrics.timer("login", server=self.breaker.label):
+            await wait_for(client.async_ensure_login(), timeout=REQUEST_TIMEOUT)
+
+        # the requests run concurrently, each one with its own deadline,
+        # the manifest and server config are only read when their cache
+        # expired
+        resp = dict()
+        names = ["cameras"]
+        for name in ["manifest", "server_config"]:
+            resp[name] = self.get_static(name)
+            if resp[name] is None:
+                names.append(name)
+        results = await asyncio.gather(
+            *[self._async_get(client, name) for name in names],
+            return_exceptions=True,
+        )
+
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                if name == "cameras":
+                    raise result
+                # keep the camera list even if the other requests failed
+                logger.debug(f"Query of {name} failed for {self.server} : {result!r}")
+                result = None
+            elif name != "cameras":
+                self.static_cache[name] = (result, time())
+            resp[name] = result
+        return resp
+
+    async def _async_get(self, client, name):
+        with metrics.timer(name, server=self.breaker.label):
+            return await wait_for(
+                client.async_call("async_get_" + name), timeout=REQUEST_TIMEOUT
+            )
+
+
+# one poller per MotionEyeServer in this process
+_pollers = {}
+
+
+def server_settings(server):
+    """
+    settings of a MotionEyeServer used by its cached queries
+    """
+    return server_key(server) + (getattr(server, "static_config_ttl", 0),)
+
+
+def get_server_poller(server):
+    """
+    return the poller shared by all the devices of a MotionEyeServer, its
+    cache is dropped when the handlers of a restarted DAQ process bring a
+    changed server, and its client when the url or credentials changed
+    """
+    if server.pk not in _pollers:
+        _pollers[server.pk] = ServerPoller(server)
+    elif server is not _pollers[server.pk].server:
+        previous = _pollers[server.pk].server
+        if server_settings(server) != server_settings(previous):
+            _pollers[server.pk].invalidate()
+        _pollers[server.pk].server = server
+        if server_key(server) != server_key(previous) and not any(
+            server_key(p.server) == server_key(previous) for p in _pollers.values()
+        ):
+            # no other server uses the client anymore
+            get_event_loop().submit(client_pool.async_discard(previous))
+    return _pollers[server.pk]
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from pyscada.models import Device, Variable
+from . import PROTOCOL_ID
+from pyscada import signals as pyscada_signals
+from pyscada.models import Device, Variable, BackgroundProcess
 from .models import (
     MotionEyeServer,
     MotionEyeDevice,
@@ -11,12 +13,34 @@ from .models import (
 )
 
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, pre_delete
+
+from functools import partial
+from threading import Lock, Timer
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# seconds to wait for other changes before restarting the DAQ processes
+REINIT_DELAY = 1.0
+
+_reinit_lock = Lock()
+_reinit_device_ids = set()
+_reinit_process_ids = set()
+_reinit_timer = None
+
+# the pyscada receivers restart the parent process for every MotionEye device
+# and variable, they are reconnected below behind a protocol check
+for _signal, _receiver in (
+    (post_save, pyscada_signals._reinit_daq_daemons),
+    (pre_delete, pyscada_signals._del_daq_daemons),
+):
+    for _sender in (Device, Variable):
+        _signal.disconnect(_receiver, sender=_sender)
+
 
 @receiver(post_save, sender=MotionEyeServer)
 @receiver(post_save, sender=MotionEyeDevice)
@@ -28,17 +52,128 @@ def _reinit_daq_daemons(sender, instance, **kwargs):
     update the daq daemon configuration when changes be applied in the models
     """
     if type(instance) is MotionEyeDevice:
-        post_save.send_robust(sender=Device, instance=instance.motioneye_device)
+        device_ids = [instance.motioneye_device_id]
     elif type(instance) is MotionEyeServer:
-        for camera in instance.motioneyedevice_set.all():
-            post_save.send_robust(sender=Device, instance=camera.motioneye_device)
+        device_ids = list(
+            instance.motioneyedevice_set.values_list("motioneye_device_id", flat=True)
+        )
     elif type(instance) is MotionEyeVariable:
-        post_save.send_robust(sender=Variable, instance=instance.motioneye_variable)
+        device_ids = [instance.motioneye_variable.device_id]
     elif type(instance) is ExtendedMotionEyeVariable:
-        post_save.send_robust(
-            sender=Variable, instance=Variable.objects.get(pk=instance.pk)
-        )
+        device_ids = [instance.device_id]
     elif type(instance) is ExtendedMotionEyeDevice:
-        post_save.send_robust(
-            sender=Device, instance=Device.objects.get(pk=instance.pk)
-        )
+        device_ids = [instance.pk]
+    else:
+        return
+    queue_reinit(device_ids)
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_save, sender=Variable)
+def _reinit_pyscada_daq_daemons(sender, instance, **kwargs):
+    """
+    queue the restart for the MotionEye devices and variables, leave the
+    others to pyscada
+    """
+    device = _motioneye_device(instance)
+    if device is None:
+        return pyscada_signals._reinit_daq_daemons(sender, instance, **kwargs)
+    queue_reinit([device.pk])
+
+
+@receiver(pre_delete, sender=Device)
+@receiver(pre_delete, sender=Variable)
+def _del_pyscada_daq_daemons(sender, instance, **kwargs):
+    """
+    queue the restart for the deleted MotionEye devices and variables, leave
+    the others to pyscada
+    """
+    device = _motioneye_device(instance)
+    if device is None:
+        return pyscada_signals._del_daq_daemons(sender, instance, **kwargs)
+    if type(instance) is Device:
+        # the device is gone once the transaction commits
+        queue_reinit([], [bp.pk for bp in _daq_processes(device)])
+    else:
+        queue_reinit([device.pk])
+
+
+def _motioneye_device(instance):
+    if type(instance) is Device:
+        device = instance
+    elif type(instance) is Variable:
+        device = instance.device
+    else:
+        return None
+    return device if device.protocol_id == PROTOCOL_ID else None
+
+
+def queue_reinit(device_ids, process_ids=()):
+    """
+    restart the DAQ processes of these devices and these processes once the
+    transaction commits, dropped on rollback
+    """
+    transaction.on_commit(partial(_schedule_reinit, device_ids, process_ids))
+
+
+def _schedule_reinit(device_ids, process_ids=()):
+    """
+    restart the DAQ processes of the devices once no change came for
+    REINIT_DELAY seconds
+    """
+    global _reinit_timer
+    with _reinit_lock:
+        _reinit_device_ids.update(d for d in device_ids if d is not None)
+        _reinit_process_ids.update(process_ids)
+        if _reinit_timer is not None:
+            _reinit_timer.cancel()
+        # not a daemon thread, a management command waits for it before exiting
+        _reinit_timer = Timer(REINIT_DELAY, _reinit)
+        _reinit_timer.start()
+
+
+def _reinit():
+    global _reinit_timer
+    with _reinit_lock:
+        device_ids = set(_reinit_device_ids)
+        _reinit_device_ids.clear()
+        process_ids = set(_reinit_process_ids)
+        _reinit_process_ids.clear()
+        _reinit_timer = None
+    try:
+        processes = {
+            bp.pk: bp
+            for bp in BackgroundProcess.objects.filter(
+                pk__in=process_ids, done=False, failed=False
+            )
+        }
+        for device in Device.objects.filter(pk__in=device_ids).select_related(
+            "motioneyedevice"
+        ):
+            for bp in _daq_processes(device):
+                processes[bp.pk] = bp
+        for bp in processes.values():
+            logger.debug(f"Restart {bp} for the changes of the MotionEye devices")
+            bp.restart()
+    except Exception:
+        logger.warning("Cannot restart the MotionEye DAQ processes", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def _daq_processes(device):
+    """
+    return the running processes of a device, its parent process for a new
+    device
+    """
+    from .worker import Process
+
+    labels = Q(label=Process.bp_label % device.pk)
+    if hasattr(device, "motioneyedevice"):
+        group = "server%s" % device.motioneyedevice.motioneye_server_id
+        labels |= Q(label=Process.bp_label % group)
+        labels |= Q(label__startswith=Process.bp_label % (group + "-"))
+    processes = list(BackgroundProcess.objects.filter(labels, done=False, failed=False))
+    if not len(processes):
+        processes = list(BackgroundProcess.objects.filter(pk=PROTOCOL_ID))
+    return processes
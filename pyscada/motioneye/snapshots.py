@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .server import get_server_poller, CircuitOpenError
+
+from collections import namedtuple
+from time import time
+import hashlib
+
+import asyncio
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+Frame = namedtuple("Frame", ["data", "timestamp", "etag"])
+
+
+class SnapshotBuffer:
+    """
+    Last frames of a camera, in a fixed number of slots allocated once
+    """
+
+    def __init__(self, size):
+        self.slots = [None] * max(size, 1)
+        # slot of the latest frame
+        self.index = -1
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, data, timestamp):
+        """
+        store a JPEG over the oldest frame, return the new frame
+        """
+        frame = Frame(data, timestamp, '"{}"'.format(hashlib.sha1(data).hexdigest()))
+        latest = self.get()
+        if latest is not None and latest.etag == frame.etag:
+            # same image, keep the slots for different ones
+            frame = frame._replace(data=latest.data)
+            self.slots[self.index] = frame
+            return frame
+        self.index = (self.index + 1) % len(self.slots)
+        self.slots[self.index] = frame
+        self.count = min(self.count + 1, len(self.slots))
+        return frame
+
+    def get(self, age=0):
+        """
+        return the frame stored age frames before the latest one, None if it
+        is not in the buffer anymore
+        """
+        if age < 0 or age >= self.count:
+            return None
+        return self.slots[(self.index - age) % len(self.slots)]
+
+
+class SnapshotSource:
+    """
+    Fetch the snapshots of a camera. Runs on the event loop.
+
+    All the viewers asking for a snapshot within min_interval seconds get the
+    same frame, at most one request is sent to the server at a time.
+    """
+
+    # min seconds between two snapshot requests of a camera
+    min_interval = 1.0
+
+    def __init__(self, server, camera_id, size):
+        self.server = server
+        self.camera_id = camera_id
+        self.buffer = SnapshotBuffer(size)
+        # seconds between two scheduled fetches, 0 for on demand only
+        self.period = 0
+        self.last_fetch = 0
+        self._fetch = None
+        self._schedule_task = None
+
+    def configure(self, server, camera_id, size, period):
+        self.server = server
+        self.camera_id = camera_id
+        if size != len(self.buffer.slots):
+            buffer = SnapshotBuffer(size)
+            for age in reversed(range(min(len(self.buffer), len(buffer.slots)))):
+                frame = self.buffer.get(age)
+                buffer.push(frame.data, frame.timestamp)
+            self.buffer = buffer
+        self.period = period
+        if self.period and self._schedule_task is None:
+            self._schedule_task = asyncio.ensure_future(self.async_run_schedule())
+
+    async def async_get(self, max_age=None):
+        """
+        return the latest frame if younger than max_age seconds, fetch a new
+        one otherwise
+        """
+        if max_age is None:
+            max_age = self.min_interval
+        frame = self.buffer.get()
+        if frame is not None and (
+            time() - frame.timestamp < max_age
+            or time() - self.last_fetch < self.min_interval
+        ):
+            return frame
+        if self._fetch is None:
+            self._fetch = asyncio.ensure_future(self.async_fetch())
+        # a viewer leaving does not cancel the fetch of the others
+        return await asyncio.shield(self._fetch)
+
+    async def async_fetch(self):
+        try:
+            self.last_fetch = time()
+            data = await get_server_poller(self.server).async_call(
+                "async_get_camera_snapshot", self.camera_id, camera=self.camera_id
+            )
+            return self.buffer.push(data, time())
+        finally:
+            self._fetch = None
+
+    async def async_run_schedule(self):
+        try:
+            while self.period:
+                try:
+                    await self.async_get(max_age=self.period)
+                except CircuitOpenError:
+                    pass
+                except Exception as e:
+                    logger.debug(
+                        "Snapshot of camera {} of {} failed : {}".format(
+                            self.camera_id, self.server, e
+                        )
+                    )
+                await asyncio.sleep(self.period)
+        finally:
+            self._schedule_task = None
+
+
+# device id -> SnapshotSource, kept when the device handler is created again
+_sources = {}
+
+
+async def async_get_snapshot_source(device_id, server, camera_id, size, period):
+    """
+    return the snapshot source of a camera device
+    """
+    if device_id not in _sources:
+        _sources[device_id] = SnapshotSource(server, camera_id, size)
+    _sources[device_id].configure(server, camera_id, size, period)
+    return _sources[device_id]
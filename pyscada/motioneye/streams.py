@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .pool import client_pool
+from .server import REQUEST_TIMEOUT
+from .metrics import metrics
+
+import asyncio
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+
+    driver_ok = True
+except ImportError:
+    logger.error("Cannot import aiohttp", exc_info=True)
+    driver_ok = False
+
+# boundary of the multipart stream sent to the viewers
+BOUNDARY = "pyscadamotioneyeframe"
+
+
+class StreamRelay:
+    """
+    One MJPEG connection to a camera, its frames copied to every viewer. Runs on
+    the event loop.
+    """
+
+    # frames waiting for a viewer, the oldest is dropped for slow viewers
+    queue_size = 2
+    # seconds before connecting again to a stream which failed or ended
+    retry_delay = 5
+    # seconds without a frame before the stream is considered lost
+    read_timeout = 30
+
+    def __init__(self, server, camera_id, async_get_url):
+        self.server = server
+        self.camera_id = camera_id
+        # coroutine function returning the stream url of the camera, or None
+        self.async_get_url = async_get_url
+        self.subscribers = set()
+        self.task = None
+
+    def labels(self):
+        return dict(server=str(self.server), camera=self.camera_id)
+
+    def subscribe(self):
+        """
+        return a queue receiving the next frames, encoded as multipart parts
+        """
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        metrics.set("motioneye_stream_viewers", len(self.subscribers), **self.labels())
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.async_run())
+        return queue
+
+    def unsubscribe(self, queue):
+        """
+        stop sending frames to a queue, close the camera stream without viewers
+        """
+        self.subscribers.discard(queue)
+        metrics.set("motioneye_stream_viewers", len(self.subscribers), **self.labels())
+        if not len(self.subscribers) and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, frame):
+        """
+        queue an encoded frame for every viewer
+        """
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                metrics.inc("motioneye_stream_dropped_frames_total", **self.labels())
+            queue.put_nowait(frame)
+
+    async def async_run(self):
+        while len(self.subscribers):
+            try:
+                await self.async_relay()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.info(
+                    "Stream of camera {} of {} failed : {}".format(
+                        self.camera_id, self.server, e
+                    )
+                )
+            await asyncio.sleep(self.retry_delay)
+
+    async def async_relay(self):
+        url = await self.async_get_url()
+        if url is None:
+            raise ValueError("streaming disabled")
+        session = client_pool.get(self.server).session
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=REQUEST_TIMEOUT, sock_read=self.read_timeout
+        )
+        async with session.get(url, timeout=timeout) as response:
+            response.raise_for_status()
+            reader = aiohttp.MultipartReader(response.headers, response.content)
+            while True:
+                part = await reader.next()
+                if part is None:
+                    return
+                self.publish(frame_part(await part.read()))
+
+
+# MotionEyeDevice id -> StreamRelay
+_relays = {}
+
+
+def get_stream_relay(motioneye_device_id, server, camera_id, async_get_url):
+    """
+    return the relay of a camera, to call on the event loop
+    """
+    if motioneye_device_id not in _relays:
+        _relays[motioneye_device_id] = StreamRelay(server, camera_id, async_get_url)
+    relay = _relays[motioneye_device_id]
+    relay.server = server
+    relay.camera_id = camera_id
+    relay.async_get_url = async_get_url
+    return relay
+
+
+def frame_part(frame):
+    """
+    return a JPEG frame as a part of the multipart stream sent to the viewers
+    """
+    return (
+        "--{}\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n".format(
+            BOUNDARY, len(frame)
+        ).encode()
+        + frame
+        + b"\r\n"
+    )
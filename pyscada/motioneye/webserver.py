@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .loop import get_event_loop
+from .metrics import metrics, merge_rendered
+from .server import CircuitOpenError, REQUEST_TIMEOUT
+from .streams import BOUNDARY
+
+from email.utils import parsedate_to_datetime
+from functools import partial
+import socket
+
+import asyncio
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+    from aiohttp import web
+
+    driver_ok = True
+except ImportError:
+    logger.error("Cannot import aiohttp", exc_info=True)
+    driver_ok = False
+
+
+def is_not_modified(request, frame):
+    """
+    return True if the client already has this frame
+    """
+    if "If-None-Match" in request.headers:
+        etags = [e.strip() for e in request.headers["If-None-Match"].split(",")]
+        return "*" in etags or frame.etag in etags or "W/" + frame.etag in etags
+    if "If-Modified-Since" in request.headers:
+        try:
+            since = parsedate_to_datetime(request.headers["If-Modified-Since"])
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have a resolution of one second
+        return int(frame.timestamp) <= since.timestamp()
+    return False
+
+
+# headers of a request forwarded to the DAQ process of its device, matched
+# without case
+FORWARDED_REQUEST_HEADERS = ["Content-Type", "If-None-Match", "If-Modified-Since"]
+# headers of the answer sent back
+FORWARDED_RESPONSE_HEADERS = [
+    "Content-Type",
+    "Content-Length",
+    "Cache-Control",
+    "ETag",
+    "Last-Modified",
+]
+
+
+class WebServer:
+    """
+    HTTP server receiving the motionEye web hooks and serving the snapshots and
+    streams. Each DAQ process listens on a local port, the worker process
+    listens on the web hook ports and forwards the requests to the process of
+    their device.
+    """
+
+    def __init__(self):
+        self.runner = None
+        # port -> TCPSite
+        self.sites = dict()
+        # device id -> device handler
+        self.handlers = dict()
+        # device id -> local port of the DAQ process of the device
+        self.routes = dict()
+        # local port -> label of the DAQ processes whose metrics are served
+        # with the ones of this process, labelled with label
+        self.peers = dict()
+        self.label = ""
+        # session forwarding the requests to the DAQ processes
+        self.session = None
+
+    def register(self, device_id, handler):
+        self.handlers[device_id] = handler
+
+    def unregister(self, device_id):
+        self.handlers.pop(device_id, None)
+
+    def get_device_id(self, request):
+        try:
+            return int(request.match_info.get("device_id"))
+        except (TypeError, ValueError):
+            return None
+
+    def get_handler(self, request):
+        handler = self.handlers.get(self.get_device_id(request))
+        if handler is None:
+            raise web.HTTPNotFound()
+        return handler
+
+    async def async_dispatch(self, request, handler):
+        """
+        forward the requests of the devices of other DAQ processes, check the
+        token of the requests of the devices of this process
+        """
+        device_id = self.get_device_id(request)
+        if device_id not in self.handlers and device_id in self.routes:
+            return await self.async_forward(request, self.routes[device_id])
+        if device_id in self.handlers and not self.handlers[device_id].is_token_valid(
+            request.query.get("token")
+        ):
+            raise web.HTTPForbidden()
+        return await handler(request)
+
+    def get_session(self):
+        """
+        return the session of the requests to the DAQ processes, to call on
+        the loop
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession(auto_decompress=False)
+        return self.session
+
+    async def async_forward(self, request, port):
+        """
+        send a request to the local port of a DAQ process and stream back its
+        answer
+        """
+        try:
+            upstream = await self.get_session().request(
+                request.method,
+                "http://127.0.0.1:{}{}".format(port, request.rel_url),
+                headers={
+                    k: request.headers[k]
+                    for k in FORWARDED_REQUEST_HEADERS
+                    if k in request.headers
+                },
+                data=await request.read(),
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT),
+            )
+        except aiohttp.ClientError as e:
+            logger.info(f"Cannot forward {request.path} to port {port} : {e}")
+            raise web.HTTPBadGateway()
+        async with upstream:
+            response = web.StreamResponse(
+                status=upstream.status,
+                headers={
+                    k: upstream.headers[k]
+                    for k in FORWARDED_RESPONSE_HEADERS
+                    if k in upstream.headers
+                },
+            )
+            await response.prepare(request)
+            try:
+                async for chunk in upstream.content.iter_any():
+                    await response.write(chunk)
+            except (ConnectionResetError, aiohttp.ClientError):
+                # viewer or DAQ process gone
+                pass
+        return response
+
+    async def async_listen(self, port, host="0.0.0.0"):
+        """
+        start listening on a port, once per port for the whole process, return
+        the port or the one chosen by the system for 0, None on failure
+        """
+        if port in self.sites:
+            return port
+        if self.runner is None:
+            # a partial takes the new style middleware mark, a method does not
+            app = web.Application(
+                middlewares=[web.middleware(partial(self.async_dispatch))]
+            )
+            app.add_routes(
+                [
+                    web.get("/metrics", self.async_metrics),
+                    web.get("/motioneye/{device_id}/snapshot", self.async_snapshot),
+                    web.get("/motioneye/{device_id}/stream", self.async_stream),
+                    web.get("/motioneye/{device_id}/{event}", self.async_webhook),
+                    web.post("/motioneye/{device_id}/{event}", self.async_webhook),
+                ]
+            )
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            get_event_loop().on_stop(self.async_stop)
+        try:
+            if port:
+                site = web.TCPSite(self.runner, host, port)
+            else:
+                sock = socket.socket()
+                sock.bind((host, 0))
+                port = sock.getsockname()[1]
+                site = web.SockSite(self.runner, sock)
+            await site.start()
+        except OSError as e:
+            logger.warning(f"MotionEye worker cannot listen on port {port} : {e}")
+            return None
+        self.sites[port] = site
+        return port
+
+    async def async_stop(self):
+        if self.session is not None:
+            await self.session.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+        self.runner = None
+        self.session = None
+        self.sites = dict()
+
+    async def async_metrics(self, request):
+        text = metrics.render()
+        if len(self.peers):
+            peers = list(self.peers.items())
+            texts = await asyncio.gather(
+                *[self.async_get_metrics(port) for port, _ in peers]
+            )
+            text = merge_rendered(
+                [(self.label, text)]
+                + [(label, t) for (_, label), t in zip(peers, texts) if t is not None]
+            )
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+    async def async_get_metrics(self, port):
+        """
+        return the metrics of the DAQ process listening on a local port
+        """
+        try:
+            async with self.get_session().get(
+                "http://127.0.0.1:{}/metrics".format(port),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            ) as response:
+                response.raise_for_status()
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info(f"Cannot read the metrics of port {port} : {e}")
+            return None
+
+    async def async_snapshot(self, request):
+        """
+        latest JPEG of a camera, or an older one of the buffer with ?frame=N
+        """
+        handler = self.get_handler(request)
+        if handler.snapshots is None:
+            raise web.HTTPNotFound()
+        try:
+            age = int(request.query.get("frame", 0))
+        except ValueError:
+            raise web.HTTPBadRequest()
+        try:
+            if age:
+                frame = handler.snapshots.buffer.get(age)
+            else:
+                frame = await handler.snapshots.async_get()
+        except CircuitOpenError as e:
+            raise web.HTTPServiceUnavailable(text=str(e))
+        except Exception as e:
+            logger.info(f"Snapshot of {handler._device} failed : {e}")
+            raise web.HTTPServiceUnavailable()
+        if frame is None:
+            raise web.HTTPNotFound()
+
+        headers = {"ETag": frame.etag, "Cache-Control": "no-cache"}
+        if is_not_modified(request, frame):
+            response = web.Response(status=304, headers=headers)
+        else:
+            response = web.Response(
+                body=frame.data, content_type="image/jpeg", headers=headers
+            )
+        response.last_modified = frame.timestamp
+        return response
+
+    async def async_stream(self, request):
+        """
+        MJPEG stream of a camera, relayed from a single connection to the camera
+        """
+        handler = self.get_handler(request)
+        if await handler.async_get_stream_url() is None:
+            raise web.HTTPNotFound()
+        relay = handler.stream_relay()
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "multipart/x-mixed-replace; boundary=" + BOUNDARY,
+                "Cache-Control": "no-cache",
+            }
+        )
+        await response.prepare(request)
+        queue = relay.subscribe()
+        try:
+            while True:
+                await response.write(await queue.get())
+        except ConnectionResetError:
+            # viewer gone
+            pass
+        finally:
+            relay.unsubscribe(queue)
+        return response
+
+    async def async_webhook(self, request):
+        handler = self.get_handler(request)
+        params = dict(request.query)
+        params.pop("token", None)
+        if request.method == "POST" and request.can_read_body:
+            try:
+                params.update(await request.post())
+            except ValueError:
+                pass
+        handler.push_event(request.match_info["event"], params)
+        return web.Response(text="OK")
+
+
+web_server = WebServer()
@@ -3,17 +3,231 @@
 
 from __future__ import unicode_literals
 
-from pyscada.utils.scheduler import SingleDeviceDAQProcessWorker
+from pyscada.utils.scheduler import MultiDeviceDAQProcessWorker
+from pyscada.utils.scheduler import MultiDeviceDAQProcess
+from pyscada.models import BackgroundProcess, Device, DeviceReadTask
 from . import PROTOCOL_ID
+from .loop import get_event_loop
+from .models import MotionEyeServer
+from .server import get_server_poller
+from .archive import Archiver
+from .webserver import web_server
+
+from django.db.models import Q
+
+import asyncio
+import json
+from time import time
+from urllib.parse import urlsplit
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class Process(SingleDeviceDAQProcessWorker):
+class DAQProcess(MultiDeviceDAQProcess):
+    """
+    DAQ process polling all its motionEye devices on one asyncio loop
+    """
+
+    # local port serving the web requests of the devices of the process,
+    # forwarded by the worker process, 0 to let the system choose it
+    web_port = 0
+
+    def init_process(self):
+        self.event_loop = get_event_loop()
+        if getattr(self, "archiver", None) is None:
+            # kept by a restart, its downloads keep running
+            self.archiver = Archiver(self.event_loop)
+        self.listen()
+        result = super().init_process()
+        for device_id in list(web_server.handlers):
+            if device_id not in self.devices:
+                # removed from the process by a restart
+                web_server.unregister(device_id)
+        for device in self.devices.values():
+            if hasattr(device, "_h") and hasattr(device._h, "min_poll_interval"):
+                # a camera may be polled faster than its device polling interval
+                self.dt_set = min(self.dt_set, device._h.min_poll_interval())
+                self.dt_query_data = min(
+                    self.dt_query_data, device._h.min_poll_interval()
+                )
+        return result
+
+    def listen(self):
+        """
+        listen on the local port and announce it to the worker process in the
+        process_class_kwargs of this process
+        """
+        port = self.event_loop.run(
+            web_server.async_listen(int(self.web_port), host="127.0.0.1")
+        )
+        if port is None and int(self.web_port):
+            # taken by another process since the last start
+            port = self.event_loop.run(web_server.async_listen(0, host="127.0.0.1"))
+        if port is None:
+            return
+        self.web_port = port
+        bp = BackgroundProcess.objects.filter(pk=self.process_id).first()
+        if bp is None:
+            return
+        kwargs = json.loads(bp.process_class_kwargs or "{}")
+        if kwargs.get("web_port") != port:
+            kwargs["web_port"] = port
+            BackgroundProcess.objects.filter(pk=self.process_id).update(
+                process_class_kwargs=json.dumps(kwargs)
+            )
+
+    def loop(self):
+        read_tasks = self.pending_read_tasks()
+        if time() - self.last_query > self.dt_query_data or len(read_tasks):
+            for device_id in read_tasks:
+                if device_id in self.devices and hasattr(self.devices[device_id], "_h"):
+                    self.devices[device_id]._h.poll_now()
+            # query each server once and concurrently, the devices then read
+            # their camera from the shared camera list
+            self.event_loop.run(self.async_refresh_servers())
+        # movie downloads run in the background on the loop
+        self.archiver.run(self.device_ids)
+        return super().loop()
+
+    def pending_read_tasks(self):
+        """
+        ids of the devices having a DeviceReadTask to run, polled even if
+        their camera is idle
+        """
+        device_ids = set()
+        for values in DeviceReadTask.objects.filter(
+            Q(done=False, start__lte=time(), failed=False)
+            & (
+                Q(device_id__in=self.device_ids)
+                | Q(variable__device_id__in=self.device_ids)
+                | Q(variable_property__variable__device_id__in=self.device_ids)
+            )
+        ).values_list(
+            "device_id", "variable__device_id", "variable_property__variable__device_id"
+        ):
+            device_ids.update(v for v in values if v is not None)
+        return device_ids
+
+    async def async_refresh_servers(self):
+        pollers = dict()
+        for device in self.devices.values():
+            if not hasattr(device, "_h") or not hasattr(device._h, "_motioneye_server"):
+                continue
+            if not device._h.is_poll_due():
+                # idle camera, read at its own pace
+                continue
+            server = device._h._motioneye_server
+            if server is not None and server.pk not in pollers:
+                pollers[server.pk] = get_server_poller(server)
+        await asyncio.gather(*[p.async_refresh() for p in pollers.values()])
+
+    def cleanup(self):
+        """
+        cancel the downloads, close the pooled clients and stop the loop
+        """
+        for device_id in getattr(self, "devices", {}):
+            web_server.unregister(device_id)
+        if getattr(self, "archiver", None) is not None:
+            self.archiver.cancel()
+        if hasattr(self, "event_loop"):
+            self.event_loop.stop()
+        super().cleanup()
+
+
+class Process(MultiDeviceDAQProcessWorker):
     device_filter = dict(motioneyedevice__isnull=False, protocol_id=PROTOCOL_ID)
+    process_class = "pyscada.motioneye.worker.DAQProcess"
     bp_label = "pyscada.motioneye-%s"
+    # "server" : one process for the cameras of each MotionEyeServer
+    # "device" : one process for each camera
+    group_by = "server"
+    # max number of cameras in a process, 0 for no limit
+    shard_size = 0
+    # port serving the metrics of all the DAQ processes, also without web hook
+    # url, 0 to serve them only on the web hook ports
+    metrics_port = 0
+    # seconds between two attempts to listen on a port that failed
+    listen_retry_interval = 60
 
     def __init__(self, dt=5, **kwargs):
-        super(SingleDeviceDAQProcessWorker, self).__init__(dt=dt, **kwargs)
+        super(MultiDeviceDAQProcessWorker, self).__init__(dt=dt, **kwargs)
+        # web hook ports this process listens on
+        self.web_ports = set()
+        # port -> time of the last failed attempt to listen on it
+        self.failed_web_ports = dict()
+
+    def init_process(self):
+        self.event_loop = get_event_loop()
+        return super().init_process()
+
+    def loop(self):
+        result = super().loop()
+        self.update_web_routes()
+        return result
+
+    def update_web_routes(self):
+        """
+        listen on the metrics port and the web hook ports of the servers,
+        forward the requests of each device to the local port of its DAQ
+        process and gather the metrics of the processes
+        """
+        routes = dict()
+        peers = dict()
+        for label, kwargs in BackgroundProcess.objects.filter(
+            parent_process__pk=self.process_id, done=False
+        ).values_list("label", "process_class_kwargs"):
+            try:
+                kwargs = json.loads(kwargs or "{}")
+            except ValueError:
+                continue
+            if kwargs.get("web_port"):
+                peers[kwargs["web_port"]] = label
+                for device_id in kwargs.get("device_ids", []):
+                    routes[device_id] = kwargs["web_port"]
+        web_server.routes = routes
+        web_server.peers = peers
+        web_server.label = self.label
+        ports = []
+        for url in (
+            MotionEyeServer.objects.exclude(webhook_url="")
+            .values_list("webhook_url", flat=True)
+            .distinct()
+        ):
+            parts = urlsplit(url)
+            ports.append(parts.port or (443 if parts.scheme == "https" else 80))
+        if int(self.metrics_port):
+            ports.append(int(self.metrics_port))
+        for port in ports:
+            if port in self.web_ports:
+                continue
+            if time() - self.failed_web_ports.get(port, 0) < self.listen_retry_interval:
+                continue
+            if self.event_loop.run(web_server.async_listen(port)) is None:
+                self.failed_web_ports[port] = time()
+            else:
+                self.web_ports.add(port)
+                self.failed_web_ports.pop(port, None)
+
+    def cleanup(self):
+        """
+        stop the web server and the loop
+        """
+        if hasattr(self, "event_loop"):
+            self.event_loop.stop()
+        super().cleanup()
+
+    def gen_group_id(self, item):
+        if self.group_by != "server":
+            return "%d" % item.pk
+        server_id = item.motioneyedevice.motioneye_server_id
+        if not self.shard_size:
+            return "server%s" % server_id
+        position = Device.objects.filter(
+            active=True,
+            motioneyedevice__motioneye_server_id=server_id,
+            pk__lt=item.pk,
+            **self.device_filter,
+        ).count()
+        return "server%s-%d" % (server_id, position // int(self.shard_size))
@@ -3,7 +3,6 @@ from setuptools import setup, find_namespace_packages
 import os
 from pyscada import motioneye as pyscada_app
 
-
 CLASSIFIERS = [
     "Development Status :: 4 - Beta",
     "Environment :: Web Environment",
@@ -34,7 +33,13 @@ setup(
         "pyscada>=0.8.0",
         "motioneye-client",
     ],
-    packages=find_namespace_packages(exclude=["project", "project.*"]),
+    extras_require={
+        # activity and brightness services
+        "analysis": ["numpy", "Pillow"],
+    },
+    packages=find_namespace_packages(
+        exclude=["project", "project.*", "benchmarks", "benchmarks.*"]
+    ),
     include_package_data=True,
     zip_safe=False,
     test_suite="runtests.main",